@@ -1,10 +1,10 @@
-import pandas as pd
+from return_stats import get_return_statistics, load_series
 
-# Load the data from the file
+# Load the data from the file (read once and kept as a Parquet sidecar, see return_stats.py)
 #file_path = '/mnt/data/bond_yield_data.csv'  # Adjust the file path as needed
 #df = pd.read_csv(file_path, parse_dates=['Date'], dayfirst=True)
 #hist_bond_yield_
-df = pd.read_excel('Historical_Debt.xlsx')
+df = load_series('Historical_Debt.xlsx', 'Date', 'Price').rename_axis('Date').reset_index()
 
 # Calculate daily returns
 # The pct_change method calculates the percentage change between the current and prior element, giving daily returns.
@@ -40,3 +40,7 @@ expected_annual_return_percentage = expected_annual_return * 100
 print(f"Expected Daily Return: {expected_daily_return:.6f}")
 print(f"Expected Annual Return: {expected_annual_return:.6f}")
 print(f"Expected Annual Return Percentage: {expected_annual_return_percentage:.2f}%")
+
+# Annualized statistics for every lookback window, from the joint equity / debt history
+stats = get_return_statistics()
+print(stats.table.loc['monthly'].loc['simple', ['debt_mean', 'debt_vol', 'correlation', 'observations']])
@@ -1,120 +1,253 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 import cvxpy as cp
-import matplotlib.pyplot as plt
-import yfinance as yf
+from cla import CornerPortfolios
+from covariance import FactorCovariance, estimate_covariance, portfolio_variance
+from data_loader import load_table
+from price_store import PriceStore
+
+# Years of daily prices used for the frontier; prices are kept in a local store and only new days are downloaded
+HISTORY_YEARS = 5
+price_store = None
+
+# Frontiers already built, by universe and price snapshot: in memory for this process and as .npz files on disk
+FRONTIER_DIRECTORY = 'frontier_cache'
+N_POINTS = 50
+# Frontier engine: 'cvxpy' solves one QP per target return, 'cla' computes the exact corner portfolios (see cla.py)
+ENGINE = 'cvxpy'
+# Covariance estimator: 'sample', 'ledoit_wolf' or 'factor' (N_FACTORS statistical factors, see covariance.py)
+COVARIANCE = 'sample'
+N_FACTORS = 10
+_frontiers = {}
 
-def get_best_return_and_risk(risk_tolerance):
-    # Load stock symbols from an Excel file
+def get_price_store():
+    global price_store
+    if price_store is None:
+        price_store = PriceStore()
+    return price_store
+
+# Load stock symbols from an Excel file
+def load_stock_symbols(path='indian_stock_symbols.xlsx'):
     '''
     This function reads an Excel file containing stock symbols.
     It cleans up the symbols by stripping any extra spaces.
     It appends .NS to each symbol to indicate they are from the National Stock Exchange of India.
     It returns a list of cleaned stock symbols.
     '''
-    stock_symbols_df = pd.read_excel('indian_stock_symbols.xlsx')
+    stock_symbols_df = load_table(path, required_columns=['Symbol'], parquet_cache=True)
     stock_symbols_df['Symbol'] = stock_symbols_df['Symbol'].astype(str).str.strip()
     stock_symbols = stock_symbols_df['Symbol'].tolist()
 
     # Add '.NS' suffix to each valid stock symbol for Yahoo Finance compatibility
-    stock_NS = [stock + '.NS' for stock in stock_symbols if isinstance(stock, str) and stock and stock.lower() != 'nan']
+    return [stock + '.NS' for stock in stock_symbols if isinstance(stock, str) and stock and stock.lower() != 'nan']
 
-    # Fetch data for all stock symbols
+# Fetch data for all stock symbols
+def load_prices(stock_NS, store=None):
     '''
-    This function fetches historical stock data for each symbol from Yahoo Finance.
-    It retrieves adjusted closing prices for the last 5 years (We can increase this to 10 years or 15 years).
-    It stores the data in a dictionary and converts it into a DataFrame.
+    This function reads historical stock data for every symbol from the local price store (see price_store.py),
+    which downloads only the days it does not have yet from Yahoo Finance, all symbols in one batch.
+    It retrieves adjusted closing prices for the last HISTORY_YEARS years (We can increase this to 10 years or 15 years).
+    Pass a PriceStore as store to use another fetcher or to run offline from the stored prices.
     '''
-    all_data = {}
+    store = store if store is not None else get_price_store()
+    data = store.history(stock_NS, years=HISTORY_YEARS)
     for symbol in stock_NS:
-        print(f"Fetching data for {symbol}...")
-        try:
-            data_temp = yf.download(symbol, period='5y', interval='1d')['Adj Close']
-            if not data_temp.empty:
-                all_data[symbol] = data_temp
-            else:
-                print(f"No data found for {symbol}, skipping...")
-        except Exception as e:
-            print(f"Error fetching data for {symbol}: {e}")
-
-    # Create a DataFrame from the fetched data
-    data = pd.DataFrame(all_data)
+        if symbol not in data.columns:
+            print(f"No data found for {symbol}, skipping...")
+    return data
 
-    # Calculate daily returns and drop missing values
-    returns = data.pct_change().dropna()
-
-    # Calculate annualized mean returns and covariance matrix
+# Calculate annualized mean returns and covariance matrix
+def return_statistics(data, covariance=COVARIANCE, n_factors=N_FACTORS):
     '''
     This function calculates the percentage change in stock prices to get monthly returns.
     It calculates the mean returns and covariance matrix and annualizes them by multiplying by 12.
-    It returns the mean returns and the covariance matrix.
+    It returns the mean returns and the covariance matrix, estimated with the covariance estimator
+    (a FactorCovariance for 'factor', a DataFrame otherwise).
     '''
+    # Calculate daily returns and drop missing values
+    returns = data.pct_change().dropna()
     mean_returns = returns.mean() * 12
-    cov_matrix = returns.cov() * 12
+    cov_matrix = estimate_covariance(returns, covariance, n_factors) * 12
+    return mean_returns, cov_matrix
 
-    # Function to optimize portfolio for a given target return
+class PortfolioProblem:
     '''
-    This function sets up and solves an optimization problem to minimize the portfolio's risk (variance) for a given target return.
+    This class sets up the optimization problem to minimize the portfolio's risk (variance) for a given target return once.
     It uses convex optimization with constraints that ensure the sum of weights is 1, expected return is at least the target return, and weights are non-negative.
-    It returns the optimized weights.
+    The target return is a cp.Parameter, so cvxpy compiles the problem on the first solve only (DPP) and
+    every later solve just updates the parameter and starts from the previous solution (warm start).
     '''
-    def optimize_portfolio(target_return, mean_returns, cov_matrix):
+
+    def __init__(self, mean_returns, cov_matrix):
         N = len(mean_returns)  # Number of assets
-        w = cp.Variable(N)  # Portfolio weights
-        objective = cp.Minimize(cp.quad_form(w, cov_matrix))  # Minimize portfolio variance
+        self.w = cp.Variable(N)  # Portfolio weights
+        self.target_return = cp.Parameter()
+        if isinstance(cov_matrix, FactorCovariance):
+            objective = cp.Minimize(cov_matrix.cvxpy_variance(self.w))  # Minimize portfolio variance, in factored form
+        else:
+            objective = cp.Minimize(cp.quad_form(self.w, np.asarray(cov_matrix)))  # Minimize portfolio variance
         constraints = [
-            cp.sum(w) == 1,  # Full investment constraint
-            w @ mean_returns >= target_return,  # Target return constraint
-            w >= 0  # No short selling constraint
+            cp.sum(self.w) == 1,  # Full investment constraint
+            self.w @ np.asarray(mean_returns) >= self.target_return,  # Target return constraint
+            self.w >= 0  # No short selling constraint
         ]
-        problem = cp.Problem(objective, constraints)
-        problem.solve()
-        return w.value
+        self.problem = cp.Problem(objective, constraints)
+
+    def solve(self, target_return):
+        '''
+        Returns the optimized weights for this target return.
+        '''
+        self.target_return.value = float(target_return)
+        self.problem.solve(warm_start=True)
+        return self.w.value
+
+# Function to optimize portfolio for a given target return
+def optimize_portfolio(target_return, mean_returns, cov_matrix):
+    '''
+    Optimized weights for a single target return. Use PortfolioProblem (or frontier_sweep) to solve for many.
+    '''
+    return PortfolioProblem(mean_returns, cov_matrix).solve(target_return)
+
+def frontier_sweep(target_returns, mean_returns, cov_matrix):
+    '''
+    Optimized weights for each target return, in order, solving one compiled problem over the whole sweep.
+    '''
+    problem = PortfolioProblem(mean_returns, cov_matrix)
+    return [problem.solve(tr) for tr in target_returns]
+
+class EfficientFrontier:
+    '''
+    The risks, returns and weights of the frontier portfolios of one universe and price snapshot.
+    The portfolio picked for each risk tolerance is worked out once when the frontier is built, so
+    best_portfolio is a lookup. It can be saved to and loaded from a .npz file.
+    '''
 
-    # Calculate the efficient frontier
+    def __init__(self, symbols, portfolio_risks, portfolio_returns, portfolio_weights):
+        self.symbols = list(symbols)
+        self.portfolio_risks = np.asarray(portfolio_risks, dtype=float)
+        self.portfolio_returns = np.asarray(portfolio_returns, dtype=float)
+        self.portfolio_weights = np.asarray(portfolio_weights, dtype=float)
+
+        # Based on risk tolerance, index is selected for high/moderate or low return
+        self.best_index = {
+            'high': int(np.argmax(self.portfolio_returns)),
+            'moderate': int(np.argmin(np.abs(self.portfolio_returns - np.mean(self.portfolio_returns)))),
+            'low': int(np.argmin(self.portfolio_risks)),
+        }
+
+    # Function to provide the best portfolio based on user risk tolerance
+    def best_portfolio(self, risk_tolerance):
+        if risk_tolerance not in self.best_index:
+            raise ValueError("Risk tolerance must be 'high', 'moderate', or 'low'.")
+        index = self.best_index[risk_tolerance]
+        return self.portfolio_weights[index], self.portfolio_returns[index], self.portfolio_risks[index]
+
+    # Plot the efficient frontier
+    def plot(self):
+        import matplotlib.pyplot as plt
+
+        plt.figure(figsize=(10, 6))
+        plt.plot(self.portfolio_risks, self.portfolio_returns, 'o-')
+        plt.xlabel('Risk (Standard Deviation)')
+        plt.ylabel('Return')
+        plt.title('Efficient Frontier')
+        plt.show()
+
+    def save(self, path):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, symbols=np.array(self.symbols), portfolio_risks=self.portfolio_risks,
+                     portfolio_returns=self.portfolio_returns, portfolio_weights=self.portfolio_weights)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            return cls(saved['symbols'].tolist(), saved['portfolio_risks'], saved['portfolio_returns'], saved['portfolio_weights'])
+
+# Calculate the efficient frontier
+def build_frontier(mean_returns, cov_matrix, n_points=N_POINTS, workers=1, engine=ENGINE):
     '''
-    This function calculates the efficient frontier by optimizing the portfolio for a range of target returns.
+    This function calculates the efficient frontier by optimizing the portfolio for a range of n_points target returns.
     It stores the risks, returns, and weights for each optimized portfolio.
+    With workers > 1 the target returns are split into that many contiguous sweeps solved in parallel processes.
+    With engine='cla' no solver is used: the portfolios are interpolated between the exact corner portfolios.
     '''
+    target_returns = np.linspace(mean_returns.min(), mean_returns.max(), n_points)
+    if engine == 'cla':
+        portfolio_risks, portfolio_returns, portfolio_weights = CornerPortfolios(
+            mean_returns, cov_matrix.dense() if isinstance(cov_matrix, FactorCovariance) else cov_matrix).frontier(target_returns)
+        return EfficientFrontier(mean_returns.index, portfolio_risks, portfolio_returns, portfolio_weights)
+    if engine != 'cvxpy':
+        raise ValueError("Frontier engine must be 'cvxpy' or 'cla'.")
 
-    target_returns = np.linspace(mean_returns.min(), mean_returns.max(), 50)
     portfolio_risks = []
     portfolio_returns = []
     portfolio_weights = []
 
-    for tr in target_returns:
-        optimal_weights = optimize_portfolio(tr, mean_returns, cov_matrix)
-        portfolio_risks.append(np.sqrt(optimal_weights @ cov_matrix @ optimal_weights))  # Portfolio risk
+    if workers > 1:
+        sweeps = [sweep for sweep in np.array_split(target_returns, workers) if len(sweep)]
+        with ProcessPoolExecutor(max_workers=len(sweeps)) as executor:
+            futures = [executor.submit(frontier_sweep, sweep, mean_returns, cov_matrix) for sweep in sweeps]
+            sweep_weights = [weights for future in futures for weights in future.result()]
+    else:
+        sweep_weights = frontier_sweep(target_returns, mean_returns, cov_matrix)
+
+    for optimal_weights in sweep_weights:
+        portfolio_risks.append(np.sqrt(portfolio_variance(optimal_weights, cov_matrix)))  # Portfolio risk
         portfolio_returns.append(optimal_weights @ mean_returns)  # Portfolio return
         portfolio_weights.append(optimal_weights)
 
-    # Plot the efficient frontier
-    plt.figure(figsize=(10, 6))
-    plt.plot(portfolio_risks, portfolio_returns, 'o-')
-    plt.xlabel('Risk (Standard Deviation)')
-    plt.ylabel('Return')
-    plt.title('Efficient Frontier')
-    plt.show()
+    return EfficientFrontier(mean_returns.index, portfolio_risks, portfolio_returns, portfolio_weights)
 
-    # Function to provide the best portfolio based on user risk tolerance
+def frontier_key(data, n_points=N_POINTS, engine=ENGINE, covariance=COVARIANCE, n_factors=N_FACTORS):
     '''
-    Based on user input, index is selected for high/moderate or low return.
+    Identifies a universe and price snapshot: the symbols, the dates and every price, and how the frontier is built.
     '''
+    digest = hashlib.sha256(repr((list(data.columns), n_points, engine, covariance, n_factors)).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
 
-    def get_best_portfolio(risk_tolerance):
-        if (risk_tolerance == 'high'):
-            index = np.argmax(portfolio_returns)
-        elif (risk_tolerance == 'moderate'):
-            index = np.argmin(np.abs(np.array(portfolio_returns) - np.mean(portfolio_returns)))
-        elif (risk_tolerance == 'low'):
-            index = np.argmin(portfolio_risks)
-        else:
-            raise ValueError("Risk tolerance must be 'high', 'moderate', or 'low'.")
-        
-        return portfolio_weights[index], portfolio_returns[index], portfolio_risks[index]
+def get_frontier(store=None, n_points=N_POINTS, directory=FRONTIER_DIRECTORY, workers=1, engine=ENGINE,
+                 covariance=COVARIANCE, n_factors=N_FACTORS):
+    '''
+    Returns the EfficientFrontier of the current universe and prices, building it only when this
+    universe and price snapshot has not been seen before (in this process or on disk).
+    n_points is the frontier resolution, workers the number of parallel sweeps used to build it,
+    engine 'cvxpy' or 'cla' (see build_frontier) and covariance / n_factors the covariance estimator.
+    '''
+    data = load_prices(load_stock_symbols(), store)
+    key = frontier_key(data, n_points, engine, covariance, n_factors)
+    if key in _frontiers:
+        return _frontiers[key]
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{key}.npz')
+    try:
+        frontier = EfficientFrontier.load(path)
+    except (FileNotFoundError, ValueError, OSError, KeyError):
+        mean_returns, cov_matrix = return_statistics(data, covariance, n_factors)
+        frontier = build_frontier(mean_returns, cov_matrix, n_points, workers, engine)
+        frontier.save(path)
+    _frontiers[key] = frontier
+    return frontier
+
+def get_best_return_and_risk(risk_tolerance, store=None, show_plot=False):
+    '''
+    Best portfolio on the efficient frontier for the given risk tolerance ('high', 'moderate' or 'low'),
+    as (best_return, best_risk, best_weights). The frontier is built once per universe and price snapshot
+    and shared by every later call. show_plot=True draws the frontier.
+    '''
+    frontier = get_frontier(store)
+    if show_plot:
+        frontier.plot()
 
     # Get best portfolio based on user risk tolerance
-    best_weights, best_return, best_risk = get_best_portfolio(risk_tolerance)
+    best_weights, best_return, best_risk = frontier.best_portfolio(risk_tolerance)
 
     return best_return, best_risk, best_weights
 
@@ -1,6 +1,16 @@
-from flask import Flask, render_template, request, redirect, send_file
+from flask import Flask, Response, jsonify, render_template, request, redirect, send_file, url_for
+import os
 import pandas as pd
 from datetime import datetime
+from functools import partial
+import tempfile
+from io import BytesIO
+from openpyxl import Workbook
+import numpy as np
+from data_loader import load_table
+from job_queue import JobQueue
+from result_cache import ResultCache
+from sip_calculator import minimum_sip, minimum_sip_vectorized
 
 app = Flask(__name__)
 
@@ -20,13 +30,8 @@ def calculate_minimum_investment(A, EYR, DYR, Y, dt_per, eq_per, goal_amount, re
     M = Y * 12
 
     if reserve_bool == False:
-        for i in range(1, int(A) + 1):
-                FV = ((i * (dt_per / 100)) * ((((1 + DMR) ** (M)) - 1) * (1 + DMR)) / DMR) + (
-                        (i * (eq_per / 100)) * ((((1 + EMR) ** (M)) - 1) * (1 + EMR)) / EMR)
-                FV = round(FV)
-                if FV >= goal_amount:
-                    return i, FV
-        return A, None
+        # Same answer as scanning i = 1 .. A for the first rounded FV >= goal_amount, in constant time
+        return minimum_sip(A, EYR, DYR, Y, dt_per, eq_per, goal_amount, upper=int(A))
 
     elif reserve_bool == True:
         FV = goal_amount
@@ -34,64 +39,320 @@ def calculate_minimum_investment(A, EYR, DYR, Y, dt_per, eq_per, goal_amount, re
         denominator = (dt_per * ((pow(1 + DMR, M) - 1) * (1 + DMR)) * EMR) + (eq_per * ((pow(1 + EMR, M) - 1) * (1 + EMR)) * DMR * 100)
         i = numerator / denominator
         return i, FV
-    
+
+def calculate_minimum_investment_columns(A, EYR, DYR, Y, dt_per, eq_per, goal_amount, reserve_bool):
+    '''
+    Same as calculate_minimum_investment for whole columns (pandas Series or NumPy arrays) at once.
+    Returns two arrays: the minimum monthly investment and the future value achieved
+    (NaN where reserve_bool is False and the goal cannot be reached with A).
+    '''
+    if reserve_bool == False:
+        return minimum_sip_vectorized(A, EYR, DYR, Y, dt_per, eq_per, goal_amount)
+
+    EYR, DYR, Y, dt_per, eq_per, goal_amount = (np.asarray(x, dtype=float) for x in (EYR, DYR, Y, dt_per, eq_per, goal_amount))
+    EMR = EYR / 12 / 100
+    DMR = DYR / 12 / 100
+    M = Y * 12
+    FV = goal_amount
+    numerator = FV * DMR * 100 * EMR
+    denominator = (dt_per * ((np.power(1 + DMR, M) - 1) * (1 + DMR)) * EMR) + (eq_per * ((np.power(1 + EMR, M) - 1) * (1 + EMR)) * DMR * 100)
+    i = numerator / denominator
+    return i, FV
+
+
+# Columns every uploaded workbook must have (goal columns come in 'Goal Amount {i}' / 'Years to Goal {i} (Y)' pairs)
+UPLOAD_REQUIRED_COLUMNS = ['Monthly SIP Amount (A)', 'Equity Yearly Rate of Return (EYR)', 'Debt Yearly Rate of Return (DYR)',
+                           'Share in Debt Percentage Monthly (dt_per)', 'Share in Equity Percentage Monthly (eq_per)']
+
+RESULT_COLUMNS = ['Client ID', 'Goal Number', 'Goal Amount', 'Future Value Achieved', 'Minimum Investment Amount Needed', 'Monthly investment Amount']
+
+def goal_numbers_of(data):
+    return [i for i in range(1, 11)  # Up to 10 goals
+            if f'Goal Amount {i}' in data.columns and f'Years to Goal {i} (Y)' in data.columns]
+
+def input_columns(goal_numbers):
+    '''
+    The columns the results of a client row depend on.
+    '''
+    return UPLOAD_REQUIRED_COLUMNS + [column for i in goal_numbers for column in (f'Goal Amount {i}', f'Years to Goal {i} (Y)')]
+
+def compute_goals(data, goal_numbers, reserve_bool=True):
+    '''
+    Minimum monthly investment and future value achieved of every goal, as two (clients, goals) arrays.
+    '''
+    n_goals = len(goal_numbers)
+
+    def per_goal(column):
+        return np.repeat(data[column].to_numpy(), n_goals)
+
+    goal_amount = data[[f'Goal Amount {i}' for i in goal_numbers]].to_numpy().ravel()
+    Y = data[[f'Years to Goal {i} (Y)' for i in goal_numbers]].to_numpy().ravel()
+    min_monthly_investment, future_value = calculate_minimum_investment_columns(
+        per_goal('Monthly SIP Amount (A)'), per_goal('Equity Yearly Rate of Return (EYR)'),
+        per_goal('Debt Yearly Rate of Return (DYR)'), Y, per_goal('Share in Debt Percentage Monthly (dt_per)'),
+        per_goal('Share in Equity Percentage Monthly (eq_per)'), goal_amount, reserve_bool)
+    shape = (len(data), n_goals)
+    return (np.asarray(min_monthly_investment, dtype=float).reshape(shape),
+            np.asarray(future_value, dtype=float).reshape(shape))
+
+def compute_goals_cached(data, goal_numbers, reserve_bool, result_cache):
+    '''
+    Same as compute_goals, reading unchanged client rows from result_cache and computing only the others.
+    '''
+    n_goals = len(goal_numbers)
+    keys = ResultCache.row_keys(ResultCache.normalize(data, input_columns(goal_numbers)), reserve_bool)
+    cached = result_cache.get_many(keys)
+    min_monthly_investment = np.empty((len(data), n_goals))
+    future_value = np.empty((len(data), n_goals))
+
+    missing = np.array([key not in cached for key in keys], dtype=bool)
+    for row in np.flatnonzero(~missing):
+        min_monthly_investment[row], future_value[row] = np.frombuffer(cached[keys[row]]).reshape(2, n_goals)
+
+    if missing.any():
+        computed = compute_goals(data[missing], goal_numbers, reserve_bool)
+        min_monthly_investment[missing], future_value[missing] = computed
+        result_cache.put_many((keys[row], np.stack([computed[0][position], computed[1][position]]).tobytes())
+                              for position, row in enumerate(np.flatnonzero(missing)))
+    return min_monthly_investment, future_value
+
+def build_results(data, reserve_bool=True, result_cache=None):
+    '''
+    Turns the uploaded workbook (one row per client, up to 10 'Goal Amount {i}' / 'Years to Goal {i} (Y)'
+    column pairs) into the output table: one row per client goal followed by a 'Total' row per client.
+    The wide goal columns are reshaped into one long table, every goal is computed in one vectorized call
+    and the totals come from a groupby, so the cost grows with the number of rows and not with pandas overhead.
+    With a result_cache only the client rows it has not seen before are computed.
+    '''
+    goal_numbers = goal_numbers_of(data)
+    n_goals = len(goal_numbers)
+
+    if result_cache is not None and n_goals:
+        min_monthly_investment, future_value = compute_goals_cached(data, goal_numbers, reserve_bool, result_cache)
+    else:
+        min_monthly_investment, future_value = compute_goals(data, goal_numbers, reserve_bool)
+    min_monthly_investment, future_value = min_monthly_investment.ravel(), future_value.ravel()
+    goal_amount = data[[f'Goal Amount {i}' for i in goal_numbers]].to_numpy().ravel()
+    A = np.repeat(data['Monthly SIP Amount (A)'].to_numpy(), n_goals)
+
+    goals = pd.DataFrame({'Client ID': np.repeat(data.index.to_numpy(), n_goals),
+                          'Goal Number': np.tile(goal_numbers, len(data)),
+                          'Goal Amount': goal_amount,
+                          'Future Value Achieved': future_value,
+                          'Minimum Investment Amount Needed': min_monthly_investment,
+                          'Monthly investment Amount': A,
+                          '_client': np.repeat(np.arange(len(data)), n_goals),
+                          '_order': np.tile(np.arange(n_goals), len(data))})
+
+    # Add a row per client for total minimum investment needed
+    totals = goals.groupby('_client', sort=False).agg({'Client ID': 'first', 'Minimum Investment Amount Needed': 'sum'}).reset_index()
+    totals['Goal Number'] = 'Total'
+    totals['Goal Amount'] = ''
+    totals['Future Value Achieved'] = ''
+    totals['Monthly investment Amount'] = ''
+    totals['_order'] = n_goals
+
+    # Each client's goals come first, then its total row
+    result = pd.concat([goals.astype(object), totals[goals.columns].astype(object)], ignore_index=True)
+    result = result.sort_values(['_client', '_order'], kind='stable', ignore_index=True)
+    return result[RESULT_COLUMNS]
+
+# Number of clients computed and written at a time when building the download
+RESULT_CHUNK_SIZE = 5000
+
+# Outputs with up to this many rows are built in memory; larger ones go through a temporary file
+EXCEL_IN_MEMORY_ROWS = 50000
+
+# Written for unreachable goals (infinite amounts), as pandas to_excel writes them
+INF_REP = 'inf'
+
+def iter_results(data, chunk_size=RESULT_CHUNK_SIZE, result_cache=None):
+    '''
+    Yields the output table of build_results chunk by chunk of clients, so only one chunk of results
+    is held in memory at a time.
+    '''
+    for first in range(0, len(data), chunk_size):
+        yield build_results(data.iloc[first:first + chunk_size], result_cache=result_cache)
+
+def stream_csv(data, chunk_size=RESULT_CHUNK_SIZE, result_cache=None):
+    '''
+    Generates the output as CSV text, header first and then one piece per chunk of clients.
+    '''
+    yield ','.join(RESULT_COLUMNS) + '\n'
+    for chunk in iter_results(data, chunk_size, result_cache):
+        yield chunk.to_csv(header=False, index=False)
+
+def excel_cell(value):
+    '''
+    NaN becomes an empty cell and an infinite amount the INF_REP marker, which openpyxl would otherwise leave empty.
+    '''
+    if pd.isna(value):
+        return None
+    if isinstance(value, (float, np.floating)) and np.isinf(value):
+        return INF_REP if value > 0 else f'-{INF_REP}'
+    return value
+
+def write_excel(data, target, chunk_size=RESULT_CHUNK_SIZE, result_cache=None):
+    '''
+    Writes the output workbook row by row with openpyxl in write-only mode to target (a path or a binary file),
+    so only one chunk of results is in memory at a time.
+    '''
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append(RESULT_COLUMNS)
+    for chunk in iter_results(data, chunk_size, result_cache):
+        for row in chunk.itertuples(index=False):
+            sheet.append([excel_cell(value) for value in row])
+    workbook.save(target)
+
+def excel_buffer(data, chunk_size=RESULT_CHUNK_SIZE, result_cache=None):
+    '''
+    Returns the output workbook as a file object positioned at the start, without writing to the working directory:
+    an in-memory buffer for outputs up to EXCEL_IN_MEMORY_ROWS rows, a temporary file (deleted on close) above that.
+    '''
+    n_rows = len(data) * (len(goal_numbers_of(data)) + 1)
+    buffer = BytesIO() if n_rows <= EXCEL_IN_MEMORY_ROWS else tempfile.TemporaryFile()
+    write_excel(data, buffer, chunk_size, result_cache)
+    buffer.seek(0)
+    return buffer
+
+# Cache of upload results: local directory and size limit in bytes
+RESULT_CACHE_DIRECTORY = 'result_cache'
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Largest finished output stored whole; bigger uploads still reuse the cached client rows
+WORKBOOK_CACHE_MAX_BYTES = 16 * 1024 * 1024
+result_cache = None
+
+def get_result_cache():
+    global result_cache
+    if result_cache is None:
+        result_cache = ResultCache(RESULT_CACHE_DIRECTORY, max_bytes=RESULT_CACHE_MAX_BYTES)
+    return result_cache
+
+def workbook_cache_key(data, output_format):
+    '''
+    Key of the finished output file of a workbook, or None when its values are not all numeric.
+    '''
+    try:
+        normalized = ResultCache.normalize(data, input_columns(goal_numbers_of(data)))
+    except (ValueError, TypeError):
+        return None
+    return ResultCache.workbook_key(normalized, data.index, output_format)
+
+def cached_csv(data, cache, key, max_bytes=WORKBOOK_CACHE_MAX_BYTES):
+    '''
+    Streams the CSV output like stream_csv and stores the finished file in the cache when it is at most max_bytes.
+    The pieces are only kept while they fit, so memory stays flat for large uploads.
+    '''
+    pieces, size = [], 0
+    for piece in stream_csv(data, result_cache=cache):
+        if pieces is not None:
+            size += len(piece)
+            if size <= max_bytes:
+                pieces.append(piece)
+            else:
+                pieces = None
+        yield piece
+    if pieces is not None:
+        cache.put(key, ''.join(pieces).encode())
+
+# Background jobs for large uploads: local job store, worker processes and result lifetime in seconds
+JOB_DIRECTORY = 'jobs'
+JOB_WORKERS = 2
+JOB_TTL_SECONDS = 24 * 3600
+job_queue = None
+
+def get_job_queue():
+    global job_queue
+    if job_queue is None:
+        job_queue = JobQueue(JOB_DIRECTORY, workers=JOB_WORKERS, ttl=JOB_TTL_SECONDS)
+    return job_queue
+
+def process_workbook(input_path, output_path, output_format='xlsx'):
+    '''
+    Job handler: reads an uploaded workbook and writes the output file, as upload_file does.
+    '''
+    data = load_table(input_path, required_columns=UPLOAD_REQUIRED_COLUMNS)
+    if output_format == 'csv':
+        with open(output_path, 'w', newline='') as f:
+            f.writelines(stream_csv(data))
+    else:
+        write_excel(data, output_path)
 
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
         file = request.files['file']
         if file:
-            data = pd.read_excel(file)
-
-            result = pd.DataFrame(columns=['Client ID', 'Goal Number', 'Goal Amount', 'Future Value Achieved', 'Minimum Investment Amount Needed', 'Monthly investment Amount'])
-
-            for client_id, row in data.iterrows():
-                A = row['Monthly SIP Amount (A)']
-                EYR = row['Equity Yearly Rate of Return (EYR)']
-                DYR = row['Debt Yearly Rate of Return (DYR)']
-                dt_per = row['Share in Debt Percentage Monthly (dt_per)']
-                eq_per = row['Share in Equity Percentage Monthly (eq_per)']
-                reserve_bool = True
-                client_results = []
-                deficit = 0
-                for i in range(1, 11):  # Loop over up to 10 goals
-                    goal_amount_col = f'Goal Amount {i}'
-                    years_to_goal_col = f'Years to Goal {i} (Y)'
-                    if goal_amount_col in row and years_to_goal_col in row:
-                        goal_amount = row[goal_amount_col]
-                        Y = row[years_to_goal_col]
-                        min_monthly_investment, future_value = calculate_minimum_investment(A, EYR, DYR, Y, dt_per, eq_per, goal_amount, reserve_bool)
-                        client_results.append({'Client ID': client_id,
-                                                'Goal Number': i,
-                                                'Goal Amount': goal_amount,
-                                                'Future Value Achieved': future_value,
-                                                'Minimum Investment Amount Needed': min_monthly_investment,
-                                                'Monthly investment Amount': A})
-
-                # Convert the list of dictionaries to a DataFrame
-                client_results_df = pd.DataFrame(client_results)
-
-                # Calculate total minimum investment needed for all goals
-                total_min_investment = client_results_df['Minimum Investment Amount Needed'].sum()
-
-                # Add a row for total minimum investment needed
-                total_row = {'Client ID': client_id,
-                             'Goal Number': 'Total',
-                             'Goal Amount': '',
-                             'Future Value Achieved': '',
-                             'Minimum Investment Amount Needed': total_min_investment,
-                             'Monthly investment Amount': ''}
-                client_results_df = pd.concat([client_results_df, pd.DataFrame([total_row])], ignore_index=True)
-
-                # Concatenate the DataFrame with the result DataFrame
-                result = pd.concat([result, client_results_df], ignore_index=True)
+            try:
+                data = load_table(file, required_columns=UPLOAD_REQUIRED_COLUMNS)
+            except ValueError as e:
+                return str(e), 400
 
             timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-            output_file = f'output_{timestamp}.xlsx'
-            result.to_excel(output_file, index=False)
-            return send_file(output_file, as_attachment=True)
+            output_format = 'csv' if request.values.get('format') == 'csv' else 'xlsx'
+            cache = get_result_cache()
+            key = workbook_cache_key(data, output_format)
+            if key is None:
+                # Non numeric values: compute without the cache so the error is the same as before
+                cache = None
+            cached = cache.get(key) if cache is not None else None
+
+            if output_format == 'csv':
+                if cached is not None:
+                    body = cached
+                elif cache is not None:
+                    body = cached_csv(data, cache, key)
+                else:
+                    body = stream_csv(data)
+                return Response(body, mimetype='text/csv',
+                                headers={'Content-Disposition': f'attachment; filename=output_{timestamp}.csv'})
+
+            if cached is not None:
+                buffer = BytesIO(cached)
+            else:
+                buffer = excel_buffer(data, result_cache=cache)
+                # Only outputs built in memory are cached whole; large ones stay on disk until sent
+                if cache is not None and isinstance(buffer, BytesIO):
+                    cache.put(key, buffer.getvalue())
+            return send_file(buffer, as_attachment=True, download_name=f'output_{timestamp}.xlsx',
+                             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
     return render_template('index.html')
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    '''
+    Queues the uploaded workbook and returns the job id straight away (HTTP 202).
+    Poll /jobs/<job_id> and download /jobs/<job_id>/result once the status is 'finished'.
+    '''
+    file = request.files.get('file')
+    if not file:
+        return jsonify({'error': 'No file uploaded.'}), 400
+    output_format = 'csv' if request.values.get('format') == 'csv' else 'xlsx'
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    job_id = get_job_queue().submit(file.read(), partial(process_workbook, output_format=output_format),
+                                    input_suffix=os.path.splitext(file.filename or '')[1],
+                                    download_name=f'output_{timestamp}.{output_format}')
+    return jsonify({'job_id': job_id, 'status': 'queued',
+                    'status_url': url_for('job_status', job_id=job_id),
+                    'result_url': url_for('job_result', job_id=job_id)}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job_queue().status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job.'}), 404
+    return jsonify({'job_id': job_id, 'status': job['status'], 'error': job['error']})
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = get_job_queue().status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job.'}), 404
+    if job['status'] != 'finished':
+        return jsonify({'job_id': job_id, 'status': job['status'], 'error': job['error']}), 409
+    return send_file(os.path.abspath(job['output_path']), as_attachment=True, download_name=job['download_name'])
+
 if __name__ == '__main__':
     app.run(debug=True)
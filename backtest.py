@@ -0,0 +1,119 @@
+import numpy as np
+
+from return_stats import DEBT_PATH, EQUITY_PATH, asset_levels, returns
+from simulator import QUANTILES, grid_lookup
+
+# Mean block length (months) of the stationary bootstrap; longer blocks keep more of the historical autocorrelation
+MEAN_BLOCK = 12
+
+
+# Function to build the monthly joint equity / debt return history
+def load_monthly_returns(equity_path=EQUITY_PATH, debt_path=DEBT_PATH, debt_duration=0.0):
+    '''
+    Monthly simple returns of the equity and debt levels of return_stats.asset_levels (Historical_Equity.xlsx Close,
+    and a total return index accruing the Historical_Debt.xlsx yield, with debt_duration for yield moves).
+    The result is oldest first, one row per month both series cover, with columns 'Equity' and 'Debt'.
+    '''
+    return returns(asset_levels(equity_path, debt_path, debt_duration), 'monthly', 'simple')
+
+
+# Function to draw stationary block bootstrap scenarios as one index array
+def bootstrap_indices(n_observations, n_scenarios, horizon, mean_block=MEAN_BLOCK, rng=None):
+    '''
+    Stationary bootstrap (Politis and Romano, 1994): each month either starts a new block at a random month,
+    with probability 1 / mean_block, or continues with the month after the previous one (wrapping around).
+    All random numbers are drawn at once. The month each scenario's current block started is found with
+    np.maximum.accumulate over the reset positions, so there is no loop over scenarios or months.
+    It returns an (n_scenarios, horizon) array of row numbers into the history.
+    '''
+    rng = np.random.default_rng(rng)
+    starts = rng.integers(0, n_observations, (n_scenarios, horizon))
+    reset = rng.random((n_scenarios, horizon)) < 1 / mean_block
+    reset[:, 0] = True
+    months = np.arange(horizon)
+    block_start = np.maximum.accumulate(np.where(reset, months, 0), axis=1)
+    first_row = np.take_along_axis(starts, block_start, axis=1)
+    return (first_row + months - block_start) % n_observations
+
+
+# Function to draw bootstrap return scenarios
+def bootstrap_scenarios(returns, n_scenarios=10000, horizon=120, mean_block=MEAN_BLOCK, rng=None):
+    '''
+    Returns an (n_scenarios, horizon, assets) array of monthly returns resampled jointly from returns,
+    so the equity and debt returns of a month always stay together.
+    '''
+    history = np.asarray(returns, dtype=float)
+    return history[bootstrap_indices(len(history), n_scenarios, horizon, mean_block, rng)]
+
+
+class BacktestResult:
+    '''
+    Outcome of one strategy over all scenarios.
+    wealth_paths: (scenarios, months + 1); allocation_paths: equity allocation used, (scenarios, months).
+    success_probability: share of scenarios ending at or above the goal (None without a goal).
+    expected_shortfall: mean amount missing from the goal over the scenarios that miss it.
+    quantiles: {q: terminal wealth quantile}.
+    '''
+
+    def __init__(self, wealth_paths, allocation_paths, goal, quantiles):
+        self.wealth_paths = wealth_paths
+        self.allocation_paths = allocation_paths
+        self.terminal_wealth = wealth_paths[:, -1]
+        self.quantiles = dict(zip(quantiles, np.quantile(self.terminal_wealth, quantiles)))
+        if goal is None:
+            self.success_probability = self.expected_shortfall = None
+        else:
+            missed = self.terminal_wealth < goal
+            self.success_probability = float(1 - missed.mean())
+            self.expected_shortfall = float((goal - self.terminal_wealth[missed]).mean()) if missed.any() else 0.0
+
+
+def _run(scenarios, allocation, initial_wealth, cash_flow, goal, quantiles):
+    # allocation(t, wealth) gives the equity allocation of every scenario at month t
+    n_scenarios, horizon, _ = scenarios.shape
+    wealth_paths = np.empty((n_scenarios, horizon + 1))
+    allocation_paths = np.empty((n_scenarios, horizon))
+    wealth_paths[:, 0] = initial_wealth
+    for t in range(horizon):
+        a = allocation(t, wealth_paths[:, t])
+        allocation_paths[:, t] = a
+        growth = 1 + a * scenarios[:, t, 0] + (1 - a) * scenarios[:, t, 1]
+        wealth_paths[:, t + 1] = (wealth_paths[:, t] + cash_flow) * growth
+    return BacktestResult(wealth_paths, allocation_paths, goal, quantiles)
+
+
+# Function to backtest a glide path (equity allocation set by the month only)
+def backtest_glide_path(scenarios, glide_path, initial_wealth, cash_flow=0.0, goal=None, quantiles=QUANTILES):
+    '''
+    glide_path is the equity allocation of every month (a single value is held constant).
+    Each month the cash flow is added first and the wealth then earns that month's mixed return, as in the DP.
+    All scenarios move together, one array operation per month.
+    '''
+    horizon = scenarios.shape[1]
+    glide_path = np.broadcast_to(np.asarray(glide_path, dtype=float), (horizon,))
+    return _run(scenarios, lambda t, wealth: np.full(len(wealth), glide_path[t]), initial_wealth, cash_flow, goal,
+                tuple(quantiles))
+
+
+# Function to backtest a DP policy (equity allocation set by the month and the current wealth)
+def backtest_policy(scenarios, allocation_table, wealth_grid, initial_wealth, cash_flow=0.0, goal=None,
+                    quantiles=QUANTILES):
+    '''
+    allocation_table is in the dp_engine layout (e.g. the allocation_table of dp.py); the allocation of a month is
+    read at the grid point at or below the current wealth, like in the DP and in simulator.simulate_policy.
+    '''
+    allocation_table = np.asarray(allocation_table, dtype=float)
+    lookup = grid_lookup(wealth_grid)
+    return _run(scenarios, lambda t, wealth: allocation_table[t, lookup(wealth)], initial_wealth, cash_flow, goal,
+                tuple(quantiles))
+
+
+if __name__ == '__main__':
+    returns = load_monthly_returns()
+    print(f"Monthly history: {len(returns)} months from {returns.index[0]} to {returns.index[-1]}")
+    scenarios = bootstrap_scenarios(returns, n_scenarios=10000, horizon=120, rng=0)
+
+    # Example: 10 years, 100000 to start, 1000 a month, goal 200000
+    for name, glide_path in [('100% equity', 1.0), ('60/40', 0.6), ('Linear glide 90% -> 20%', np.linspace(0.9, 0.2, 120))]:
+        result = backtest_glide_path(scenarios, glide_path, 100000, cash_flow=1000, goal=200000)
+        print(f"{name}: goal hit {result.success_probability:.2%}, median terminal wealth {result.quantiles[0.5]:,.0f}")
@@ -0,0 +1,155 @@
+import numpy as np
+
+# Relative tolerance used when comparing lambdas and checking the corner portfolios
+TOLERANCE = 1e-10
+
+
+class CornerPortfolios:
+    '''
+    Critical Line Algorithm (Markowitz; Bailey and Lopez de Prado, 2013) for the long-only, fully invested
+    mean-variance problem: minimize w' cov w subject to sum(w) = 1, 0 <= w <= 1 and w' mean >= target.
+    The efficient weights are piecewise linear in the target return, with kinks at the corner portfolios.
+    All corner portfolios are computed in one pass, from the highest return portfolio down to the minimum
+    variance portfolio, and any point of the frontier is then a linear interpolation between two of them.
+    '''
+
+    def __init__(self, mean_returns, cov_matrix, max_iterations=None):
+        self.mean = np.asarray(mean_returns, dtype=float)
+        self.cov = np.asarray(cov_matrix, dtype=float)
+        self.weights, self.lambdas = self._solve(max_iterations or 10 * len(self.mean) + 10)
+        self.returns = self.weights @ self.mean
+        self.risks = np.sqrt(np.einsum('ki,ij,kj->k', self.weights, self.cov, self.weights))
+
+    def _solve(self, max_iterations):
+        mean, cov = self.mean, self.cov
+        n = len(mean)
+
+        # Start from the highest mean asset alone; it is the only free asset
+        w = np.zeros(n)
+        first = int(np.argmax(mean))
+        w[first] = 1.0
+        free = np.zeros(n, dtype=bool)
+        free[first] = True
+        corners, lambdas = [w.copy()], [np.inf]
+
+        for _ in range(max_iterations):
+            F, B = np.flatnonzero(free), np.flatnonzero(~free)
+            inv = np.linalg.inv(cov[np.ix_(F, F)])
+            cov_FB = cov[np.ix_(F, B)]
+            w_B = w[B]
+            ones_F = np.ones(len(F))
+
+            c4 = inv @ ones_F              # inv 1
+            c2 = inv @ mean[F]             # inv mean
+            c1 = ones_F @ c4               # 1' inv 1
+            c3 = ones_F @ c2               # 1' inv mean
+            l3 = inv @ (cov_FB @ w_B)      # inv cov_FB w_B
+            l1 = w_B.sum()
+            l2 = l3.sum()
+
+            # a) A free asset reaches one of its bounds
+            lambda_in, asset_in, bound_in = -np.inf, None, None
+            if len(F) > 1:
+                c = -c1 * c2 + c3 * c4
+                bound = np.where(c > 0, 1.0, 0.0)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    candidates = np.where(c != 0, ((1 - l1 + l2) * c4 - c1 * (bound + l3)) / c, -np.inf)
+                j = int(np.argmax(candidates))
+                lambda_in, asset_in, bound_in = candidates[j], F[j], bound[j]
+
+            # b) A bounded asset becomes free. The inverse with asset i added is the bordered inverse of inv,
+            # so every candidate is evaluated at once without inverting a matrix per asset.
+            lambda_out, asset_out = -np.inf, None
+            if len(B):
+                U = inv @ cov_FB                                   # one column u_i per bounded asset
+                s = np.diag(cov)[B] - np.einsum('fb,fb->b', cov_FB, U)
+                su = U.sum(axis=0)                                 # 1' u_i
+                m = mean[F] @ U                                    # mean_F' u_i
+                c4_i = (1 - su) / s
+                c2_i = (mean[B] - m) / s
+                c1_i = c1 + (su - 1) ** 2 / s
+                c3_i = c3 + (m - mean[B]) * (su - 1) / s
+
+                # cov[F', B'] w_B' with F' = F + i and B' = B - i
+                z_F = cov_FB @ w_B
+                z_top = z_F[:, None] - cov_FB * w_B                # z for every candidate, one column each
+                z_i = cov[np.ix_(B, B)] @ w_B - np.diag(cov)[B] * w_B
+                uz = np.einsum('fb,fb->b', U, z_top)
+                l3_i = (z_i - uz) / s
+                l2_i = (l2 - su * w_B) + (uz - z_i) * (su - 1) / s
+                l1_i = l1 - w_B
+
+                c = -c1_i * c2_i + c3_i * c4_i
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    candidates = ((1 - l1_i + l2_i) * c4_i - c1_i * (w_B + l3_i)) / c
+                previous = lambdas[-1]
+                limit = previous - TOLERANCE * abs(previous) if np.isfinite(previous) else np.inf
+                valid = (c != 0) & (s > 0) & np.isfinite(candidates) & (candidates < limit)
+                if valid.any():
+                    j = int(np.argmax(np.where(valid, candidates, -np.inf)))
+                    lambda_out, asset_out = candidates[j], B[j]
+
+            if lambda_in < 0 and lambda_out < 0:
+                # No more turning points: the last corner is the minimum variance portfolio (lambda = 0)
+                lam = 0.0
+            elif lambda_in > lambda_out:
+                lam = lambda_in
+                free[asset_in] = False
+                w[asset_in] = bound_in
+            else:
+                lam = lambda_out
+                free[asset_out] = True
+
+            F, B = np.flatnonzero(free), np.flatnonzero(~free)
+            inv = np.linalg.inv(cov[np.ix_(F, F)])
+            ones_F = np.ones(len(F))
+            w_B = w[B]
+            w1 = inv @ (cov[np.ix_(F, B)] @ w_B)
+            gamma = (-lam * (ones_F @ inv @ mean[F]) + (1 - w_B.sum() + ones_F @ w1)) / (ones_F @ inv @ ones_F)
+            w[F] = -w1 + gamma * (inv @ ones_F) + lam * (inv @ mean[F])
+
+            corners.append(w.copy())
+            lambdas.append(lam)
+            if lam == 0:
+                break
+
+        return self._clean(np.array(corners), np.array(lambdas))
+
+    def _clean(self, corners, lambdas):
+        # Drop corners broken by rounding (outside the bounds or not fully invested), then keep the returns strictly decreasing
+        valid = ((corners >= -TOLERANCE).all(axis=1) & (corners <= 1 + TOLERANCE).all(axis=1)
+                 & (np.abs(corners.sum(axis=1) - 1) <= 1e-8))
+        corners, lambdas = np.clip(corners[valid], 0, 1), lambdas[valid]
+        returns = corners @ self.mean
+        keep = [0]
+        for k in range(1, len(corners)):
+            if returns[k] < returns[keep[-1]] - TOLERANCE * max(1.0, abs(returns[keep[-1]])):
+                keep.append(k)
+        return corners[keep], lambdas[keep]
+
+    def weights_for_return(self, target_returns):
+        '''
+        Efficient weights for each target return, one row per target.
+        Targets below the minimum variance return give the minimum variance portfolio and targets above
+        the highest return give the highest return portfolio, as the '>= target' QP does.
+        '''
+        target_returns = np.atleast_1d(np.asarray(target_returns, dtype=float))
+        if len(self.weights) == 1:
+            return np.repeat(self.weights, len(target_returns), axis=0)
+
+        # Corner returns decrease; interpolate on the reversed (increasing) order
+        returns, weights = self.returns[::-1], self.weights[::-1]
+        targets = np.clip(target_returns, returns[0], returns[-1])
+        upper = np.clip(np.searchsorted(returns, targets, side='left'), 1, len(returns) - 1)
+        lower = upper - 1
+        share = ((targets - returns[lower]) / (returns[upper] - returns[lower]))[:, None]
+        return weights[lower] + share * (weights[upper] - weights[lower])
+
+    def frontier(self, target_returns):
+        '''
+        (risks, returns, weights) of the efficient portfolios for the target returns.
+        '''
+        weights = self.weights_for_return(target_returns)
+        returns = weights @ self.mean
+        risks = np.sqrt(np.einsum('ki,ij,kj->k', weights, self.cov, weights))
+        return risks, returns, weights
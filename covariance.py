@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import cvxpy as cp
+
+# Covariance estimators for the frontier: 'sample', 'ledoit_wolf' or 'factor'
+ESTIMATORS = ('sample', 'ledoit_wolf', 'factor')
+
+
+# Function to shrink the sample covariance towards a scaled identity (Ledoit and Wolf, 2004)
+def ledoit_wolf(returns):
+    '''
+    Returns the shrunk covariance as a DataFrame and the shrinkage intensity in [0, 1].
+    The intensity is the one minimizing the expected Frobenius loss, estimated from the returns themselves,
+    so the estimate stays well conditioned when there are nearly as many symbols as observations.
+    '''
+    X = returns.to_numpy(dtype=float)
+    X = X - X.mean(axis=0)
+    n_samples, n_features = X.shape
+
+    X2 = X ** 2
+    sample = X.T @ X / n_samples
+    variances = X2.sum(axis=0) / n_samples
+    mu = variances.sum() / n_features
+    beta_ = (X2.T @ X2).sum()
+    delta_ = (sample ** 2).sum()
+    beta = (beta_ / n_samples - delta_) / (n_features * n_samples)
+    delta = (delta_ - 2 * mu * variances.sum() + n_features * mu ** 2) / n_features
+    shrinkage = 0.0 if delta == 0 else min(beta, delta) / delta
+
+    shrunk = (1 - shrinkage) * sample
+    shrunk[np.diag_indices(n_features)] += shrinkage * mu
+    return pd.DataFrame(shrunk, index=returns.columns, columns=returns.columns), shrinkage
+
+
+class FactorCovariance:
+    '''
+    Low rank plus diagonal covariance: cov = loadings @ loadings.T + diag(specific).
+    It is never formed as a dense N x N matrix by the optimizer: variance(w) = |loadings.T @ w|^2 + sum(specific * w^2),
+    which cvxpy handles in O(N*K) instead of O(N^2).
+    '''
+
+    def __init__(self, loadings, specific, index=None):
+        self.loadings = np.asarray(loadings, dtype=float)
+        self.specific = np.asarray(specific, dtype=float)
+        self.index = index
+
+    @classmethod
+    def fit(cls, returns, n_factors=10):
+        '''
+        Statistical factor model: the first n_factors principal components of the returns, with the rest of
+        each symbol's sample variance kept as its specific variance.
+        '''
+        X = returns.to_numpy(dtype=float)
+        X = X - X.mean(axis=0)
+        n_factors = min(n_factors, *X.shape)
+        _, singular_values, components = np.linalg.svd(X, full_matrices=False)
+        loadings = components[:n_factors].T * (singular_values[:n_factors] / np.sqrt(len(X) - 1))
+        variances = X.var(axis=0, ddof=1)
+        specific = np.maximum(variances - (loadings ** 2).sum(axis=1), 1e-10 * variances.max())
+        return cls(loadings, specific, returns.columns)
+
+    def __mul__(self, scale):
+        # Annualizing scales the covariance, i.e. the loadings by sqrt(scale)
+        return FactorCovariance(self.loadings * np.sqrt(scale), self.specific * scale, self.index)
+
+    __rmul__ = __mul__
+
+    def dense(self):
+        return pd.DataFrame(self.loadings @ self.loadings.T + np.diag(self.specific), index=self.index, columns=self.index)
+
+    def variance(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        return ((weights @ self.loadings) ** 2).sum(axis=-1) + (self.specific * weights ** 2).sum(axis=-1)
+
+    def cvxpy_variance(self, w):
+        return cp.sum_squares(self.loadings.T @ w) + cp.sum(cp.multiply(self.specific, cp.square(w)))
+
+
+# Function to estimate the covariance of the returns with the chosen estimator
+def estimate_covariance(returns, estimator='sample', n_factors=10):
+    '''
+    'sample' is returns.cov(), 'ledoit_wolf' the shrunk covariance (a DataFrame as well) and
+    'factor' a FactorCovariance with n_factors factors.
+    '''
+    if estimator == 'sample':
+        return returns.cov()
+    if estimator == 'ledoit_wolf':
+        return ledoit_wolf(returns)[0]
+    if estimator == 'factor':
+        return FactorCovariance.fit(returns, n_factors)
+    raise ValueError(f"Covariance estimator must be one of {', '.join(ESTIMATORS)}.")
+
+
+# Function to get the variance of one portfolio (or one per row of weights) under any of the estimates
+def portfolio_variance(weights, cov_matrix):
+    if isinstance(cov_matrix, FactorCovariance):
+        return cov_matrix.variance(weights)
+    weights = np.asarray(weights, dtype=float)
+    return np.einsum('...i,ij,...j->...', weights, np.asarray(cov_matrix, dtype=float), weights)
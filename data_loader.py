@@ -0,0 +1,89 @@
+import os
+from io import BytesIO
+
+import pandas as pd
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+CSV_EXTENSIONS = ('.csv', '.txt')
+
+
+# Function to work out the input format from the file name or, failing that, the first bytes
+def detect_format(name, head=b''):
+    '''
+    Returns 'excel', 'parquet' or 'csv'. The extension wins; without a known extension the content is sniffed
+    (xlsx is a zip file, xls an OLE2 file, Parquet starts with PAR1) and anything else is read as CSV.
+    '''
+    extension = os.path.splitext(name or '')[1].lower()
+    if extension in EXCEL_EXTENSIONS:
+        return 'excel'
+    if extension in PARQUET_EXTENSIONS:
+        return 'parquet'
+    if extension in CSV_EXTENSIONS:
+        return 'csv'
+    if head.startswith(b'PK\x03\x04') or head.startswith(b'\xd0\xcf\x11\xe0'):
+        return 'excel'
+    if head.startswith(b'PAR1'):
+        return 'parquet'
+    return 'csv'
+
+
+def _read(source, file_format, sheet_name):
+    if file_format == 'excel':
+        return pd.read_excel(source, sheet_name=sheet_name)
+    if file_format == 'parquet':
+        return pd.read_parquet(source)
+    return pd.read_csv(source)
+
+
+# Function to load an input table from Excel, CSV or Parquet
+def load_table(source, required_columns=None, sheet_name=0, parquet_cache=False, name=None):
+    '''
+    Loads a table from a path or an uploaded file object (Flask FileStorage, Streamlit UploadedFile, BytesIO).
+    The format comes from the extension of name / the file name, or from the content when there is none.
+    With parquet_cache=True an Excel file on disk is also saved as a Parquet sidecar ('<file>.parquet') the first
+    time it is read; later loads read the sidecar for as long as it is newer than the workbook.
+    The sidecar is skipped quietly when Parquet support (pyarrow) is missing or the sheet cannot be stored.
+    Raises ValueError naming any of required_columns that are missing.
+    '''
+    if isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        with open(path, 'rb') as f:
+            head = f.read(8)
+        file_format = detect_format(name or path, head)
+        if file_format == 'excel' and parquet_cache:
+            data = _load_with_sidecar(path, sheet_name)
+        else:
+            data = _read(path, file_format, sheet_name)
+    else:
+        name = name or getattr(source, 'filename', None) or getattr(source, 'name', None)
+        content = source.getvalue() if hasattr(source, 'getvalue') else source.read()
+        data = _read(BytesIO(content), detect_format(name, content[:8]), sheet_name)
+
+    if required_columns is not None:
+        missing = [column for column in required_columns if column not in data.columns]
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    return data
+
+
+def _load_with_sidecar(path, sheet_name):
+    sidecar = f'{path}.parquet' if sheet_name == 0 else f'{path}.{sheet_name}.parquet'
+    try:
+        if os.path.getmtime(sidecar) >= os.path.getmtime(path):
+            return pd.read_parquet(sidecar)
+    except (OSError, ImportError, ValueError):
+        pass
+
+    data = pd.read_excel(path, sheet_name=sheet_name)
+    try:
+        tmp_path = f'{sidecar}.{os.getpid()}.tmp'
+        data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, sidecar)
+    except Exception:
+        # No pyarrow, or a column mixing types that Parquet cannot hold: keep going without the sidecar
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return data
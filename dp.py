@@ -1,5 +1,9 @@
 import numpy as np
-import pandas as pd
+from dp_engine import grid_index, strategy_frame
+from kernel_cache import KernelCache
+from policy_cache import GoalPolicyCache
+from return_stats import get_return_statistics
+from simulator import asset_moments, simulate_policy
 
 # Define constants and parameters
 T = 10  # Time horizon in years
@@ -7,60 +11,50 @@ G = 200000  # Target wealth
 W0 = 100000  # Initial wealth
 monthly_cash_flow = 1000  # Monthly Cash Flow
 n_assets = 2  # Number of assets (Equity & Debt)
-mu = np.array([0.07, 0.12]) / 12  # Expected monthly returns (Nifty500 and Bond Yield)
-sigma = np.array([0.1, 0.2]) / np.sqrt(12)  # Monthly volatilities (Nifty500 and Bond Yield)
-corr_matrix = np.array([[1, 0.3], [0.2, 0.5]])  # Correlation matrix
-cov_matrix = np.outer(sigma, sigma) * corr_matrix  # Covariance matrix
+# Expected monthly returns, monthly volatilities and covariance matrix (Equity, Debt), from the last 10 years
+# of Historical_Equity.xlsx and Historical_Debt.xlsx (see return_stats.py)
+mu, sigma, cov_matrix = get_return_statistics().monthly_moments()
 
 # Time and wealth discretization
 months = T * 12  # Total Number of months
 time_steps = np.arange(0, months + 1)
-wealth_grid = np.linspace(0, 2 * G, 100)
-
-# Initialize dynamic programming table
-dp_table = np.zeros((len(time_steps), len(wealth_grid)))
-dp_table[-1, :] = (wealth_grid >= G).astype(int)  # Final step
-
-# Initialize the table to store the best allocation
-allocation_table = np.zeros((len(time_steps), len(wealth_grid)))
-
-# Backward recursion
-for t in reversed(range(months)):
-    for i, W in enumerate(wealth_grid):
-        max_prob = 0
-        best_allocation = 0
-        for a in np.linspace(0, 1, 11):  # Portfolio allocations
-            # Portfolio mean and variance
-            portfolio_mu = a * mu[0] + (1 - a) * mu[1]
-            portfolio_sigma = np.sqrt(a**2 * sigma[0]**2 + (1 - a)**2 * sigma[1]**2 + 2 * a * (1 - a) * cov_matrix[0, 1])
-            
-            # Expected wealth at next time step
-            expected_wealth = (W + monthly_cash_flow) * np.exp((portfolio_mu - 0.5 * portfolio_sigma**2) + portfolio_sigma * np.random.normal(0, 1))
-            j = np.searchsorted(wealth_grid, expected_wealth, side='right') - 1
-            j = np.clip(j, 0, len(wealth_grid) - 1)
-            
-            # Probability of reaching goal
-            prob = dp_table[t + 1, j]
-            if prob > max_prob:
-                max_prob = prob
-                best_allocation = a
-        
-        dp_table[t, i] = max_prob
-        allocation_table[t, i] = best_allocation
-
-# Optimal strategy
-optimal_strategy = []
-for t in range(months):
-    for i, W in enumerate(wealth_grid):
-        equity_allocation = allocation_table[t, i]
-        debt_allocation = 1 - equity_allocation
-        optimal_strategy.append((t, W, equity_allocation, debt_allocation))
-
-# Convert optimal_strategy to a DataFrame
-df_optimal_strategy = pd.DataFrame(optimal_strategy, columns=['Time', 'Wealth', 'Equity Allocation', 'Debt Allocation'])
-
-# Save the DataFrame to an Excel file
-output_file_path = '/Users/neeraj/Desktop/BAI/Python/dynamic_programming/optimal_strategy.xlsx'
-df_optimal_strategy.to_excel(output_file_path, index=False)
+n_wealth_points = 100  # The wealth grid is linspace(0, 2 * G, n_wealth_points)
+
+# Solved dp_table and allocation_table are stored in this folder as np.memmap files, so later runs with the same
+# horizon, asset parameters and cash flow to goal ratio read them back instead of solving again; this also keeps
+# production resolutions such as 30 years x 5000 wealth points x 101 allocations out of memory
+# (use transition='quadrature' then). Set to None to solve in memory every run.
+TABLE_DIRECTORY = 'policy_cache'
+
+# Paths simulated to check the policy forward; 50,000 paths give the goal probability to about +/-0.005 in well
+# under a second. Set to 1_000_000 for a full validation run (about 10 s), or 0 to skip the check.
+SIMULATION_PATHS = 50_000
+
+# Solve the DP one time slice at a time over the (wealth x allocation) grid
+# 'kernel' integrates each lognormal step exactly against the value function interpolated between grid points,
+# so the tables are deterministic and agree with 'quadrature'.
+# The tables are solved in goal-normalized units, so other goal amounts with the same horizon, asset parameters and
+# cash flow to goal ratio are served from TABLE_DIRECTORY without solving again; a new solve reuses the
+# transition kernels from the on-disk kernel cache.
+policy_cache = GoalPolicyCache(kernel_cache=KernelCache(), directory=TABLE_DIRECTORY)
+wealth_grid, dp_table, allocation_table = policy_cache.solve(G, months, mu, sigma, cov_matrix, monthly_cash_flow,
+                                                             n_points=n_wealth_points, grid_multiple=2,
+                                                             transition='kernel')
+print("DP tables", "read from" if policy_cache.hits else "solved and stored in", TABLE_DIRECTORY)
+
+# Optimal strategy (one row per month and wealth point)
+df_optimal_strategy = strategy_frame(allocation_table, wealth_grid, months)
+
+# Check the policy forward: simulate it from W0 and compare with the DP estimate at W0
+print(f"Goal probability from W0: DP {dp_table[0, grid_index(wealth_grid, W0)]:.4f}")
+if SIMULATION_PATHS:
+    simulation = simulate_policy(allocation_table, wealth_grid, W0, asset_moments(mu, sigma, cov_matrix),
+                                 cash_flow=monthly_cash_flow, goal=G, n_paths=SIMULATION_PATHS, rng=0)
+    print(f"Goal probability from W0: simulated {simulation.success_probability:.4f} ({SIMULATION_PATHS} paths)")
+    print("Terminal wealth quantiles:", {q: round(value) for q, value in simulation.quantiles.items()})
+
+# Save the DataFrame to a CSV file (one row per month and wealth point can exceed Excel's 1,048,576 row limit)
+output_file_path = '/Users/neeraj/Desktop/BAI/Python/dynamic_programming/optimal_strategy.csv'
+df_optimal_strategy.to_csv(output_file_path, index=False)
 
 print("Optimal strategy saved to:", output_file_path)
\ No newline at end of file
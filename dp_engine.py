@@ -0,0 +1,337 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+
+# Default equity allocation levels (0%, 10%, ..., 100%) used by every DP model
+ALLOCATIONS = np.linspace(0, 1, 11)
+
+# Expected values closer than this to the best one are treated as ties (lowest allocation wins)
+TIE_TOLERANCE = 1e-12
+
+
+# Function to get portfolio mean and volatility for every allocation level
+def portfolio_moments(allocations, mu, sigma, cov_matrix):
+    '''
+    This function computes the portfolio mean and volatility of each equity allocation 'a'
+    (with 1 - a in debt) in one shot, using the same formula as the original dp.py loop.
+    It returns two arrays with one entry per allocation.
+    '''
+    a = np.asarray(allocations, dtype=float)
+    portfolio_mu = a * mu[0] + (1 - a) * mu[1]
+    portfolio_sigma = np.sqrt(a**2 * sigma[0]**2 + (1 - a)**2 * sigma[1]**2 + 2 * a * (1 - a) * cov_matrix[0, 1])
+    return portfolio_mu, portfolio_sigma
+
+
+# Function to map wealth values onto the wealth grid
+def grid_index(wealth_grid, wealth):
+    '''
+    Each wealth value is mapped to the grid point at or below it (searchsorted with side='right' - 1),
+    clipped to the grid, exactly like the per-cell lookup in dp.py.
+    '''
+    j = np.searchsorted(wealth_grid, wealth, side='right') - 1
+    return np.clip(j, 0, len(wealth_grid) - 1)
+
+
+# Function to build the exact wealth-to-wealth transition weights
+def transition_kernel(wealth_grid, portfolio_mu, portfolio_sigma, cash_flow=0.0):
+    '''
+    Over one step wealth W grows to (W + cash_flow) * exp((mu - sigma^2 / 2) + sigma * Z), i.e. it is lognormal.
+    The value function is read by linear interpolation between grid points, like in 'quadrature' (wealth below the
+    grid is read at the first point, above it at the last): a W in [wealth_grid[k], wealth_grid[k + 1]) gives
+    weight (wealth_grid[k + 1] - W) / h to point k and (W - wealth_grid[k]) / h to point k + 1, h the cell width.
+    This function integrates those weights against the lognormal exactly, with the normal CDF for the probability
+    of each cell and the lognormal partial expectation for the mean of W within it.
+    It returns kernel[a, i, j] = weight of wealth point j in the expected next value from point i under allocation a
+    (every row sums to 1). Leading axes (e.g. clients) on wealth_grid, the moments and cash_flow broadcast,
+    giving kernel[..., a, i, j].
+    '''
+    wealth_grid = np.asarray(wealth_grid, dtype=float)
+    portfolio_mu = np.asarray(portfolio_mu, dtype=float)[..., :, None, None]
+    portfolio_sigma = np.asarray(portfolio_sigma, dtype=float)[..., :, None, None]
+    invested = np.asarray(wealth_grid + np.asarray(cash_flow, dtype=float)[..., None])[..., None, :, None]
+    drift = portfolio_mu - 0.5 * portfolio_sigma**2
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        log_ratio = np.log(wealth_grid[..., None, None, :]) - np.log(invested)
+        z = (log_ratio - drift) / portfolio_sigma
+        # E[W; W < x] = invested * exp(mu) * Phi(z - sigma) for the same z as P(W < x)
+        shifted = z - portfolio_sigma
+    # A zero volatility allocation landing exactly on a grid point belongs to the cell starting there
+    z = np.where(np.isnan(z), -np.inf, z)
+    shifted = np.where(np.isnan(shifted), -np.inf, shifted)
+    cdf = ndtr(z)
+    cell_probability = np.diff(cdf, axis=-1)
+    cell_mean = invested * np.exp(portfolio_mu) * np.diff(ndtr(shifted), axis=-1)
+
+    lower, upper = wealth_grid[..., None, None, :-1], wealth_grid[..., None, None, 1:]
+    width = upper - lower
+    kernel = np.zeros(cdf.shape)
+    kernel[..., :-1] += (upper * cell_probability - cell_mean) / width
+    kernel[..., 1:] += (cell_mean - lower * cell_probability) / width
+    kernel[..., 0] += cdf[..., 0]
+    kernel[..., -1] += 1 - cdf[..., -1]
+    # Rounding in the differences can leave weights a hair below zero
+    return np.maximum(kernel, 0)
+
+
+# Decimals kept when comparing goal-normalized grids, so grids that only differ by rounding share a kernel
+KERNEL_KEY_DECIMALS = 12
+
+
+# Function to express wealth grids and cash flows in units of the top of each grid
+def normalized_grid(wealth_grid, cash_flow=0.0):
+    '''
+    transition_kernel only depends on ratios of wealth, so grids that are the same up to scale
+    (e.g. linspace(0, goal, n) for any goal, with cash flows in proportion) have the same kernel.
+    Returns the grid and the cash flow divided by the last grid point, rounded to KERNEL_KEY_DECIMALS,
+    for use as a kernel key. Leading axes (e.g. clients) are kept.
+    '''
+    wealth_grid = np.asarray(wealth_grid, dtype=float)
+    top = wealth_grid[..., -1]
+    top = np.where(top > 0, top, 1.0)
+    return (np.round(wealth_grid / top[..., None], KERNEL_KEY_DECIMALS),
+            np.round(np.asarray(cash_flow, dtype=float) / top, KERNEL_KEY_DECIMALS))
+
+
+# Function to map wealth values onto each client's own wealth grid
+def batch_grid_index(wealth_grids, wealth):
+    '''
+    Same mapping as grid_index, for a stack of clients: wealth_grids is (clients, wealth points) and
+    wealth has the clients on its leading axis.
+    Every grid is rescaled onto its own block [2c, 2c + 1] of one long sorted array, so a single
+    searchsorted serves all clients. Grid points and wealth values go through the same arithmetic,
+    so a wealth value equal to a grid point still lands on that point.
+    '''
+    wealth_grids = np.asarray(wealth_grids, dtype=float)
+    n_clients, n_wealth = wealth_grids.shape
+    low = wealth_grids[:, :1]
+    span = wealth_grids[:, -1:] - low
+    span = np.where(span > 0, span, 1.0)
+    scaled_grids = (wealth_grids - low) / span
+    offset = 2.0 * np.arange(n_clients)[:, None]
+    flat_grid = (scaled_grids + offset).ravel()
+
+    shape = (n_clients,) + (1,) * (np.ndim(wealth) - 1)
+    scaled = (wealth - low.reshape(shape)) / span.reshape(shape)
+    scaled = np.clip(scaled, 0.0, scaled_grids[:, -1].reshape(shape)) + offset.reshape(shape)
+    j = np.searchsorted(flat_grid, scaled, side='right') - 1 - n_wealth * np.arange(n_clients).reshape(shape)
+    return np.clip(j, 0, n_wealth - 1)
+
+
+# Function to run backward induction for a stack of clients at once
+def backward_induction_batch(terminal_values, wealth_grids, horizons, portfolio_mu, portfolio_sigma,
+                             allocations=ALLOCATIONS, cash_flow=0.0, rng=None, transition='sample', n_nodes=20,
+                             kernel_cache=None, chunk_size=None, directory=None, folder=None):
+    '''
+    This function runs the backward recursion of the goal based DP for many clients together.
+    Every time step is computed as NumPy array operations over a (clients x wealth x allocation) grid
+    followed by one max over the allocation axis.
+
+    terminal_values and wealth_grids are (clients, wealth points); every client has the same number of points.
+    horizons holds the number of steps of each client. portfolio_mu and portfolio_sigma are the per-step
+    moments of each allocation (see portfolio_moments), one row per client or one row shared by all.
+    cash_flow (one value per client, or shared) is added to wealth before it grows over the step.
+
+    transition selects how the expected next-step value is computed:
+    'sample'     - one normal draw per cell (the original behaviour, noisy)
+    'quadrature' - Gauss-Hermite quadrature with n_nodes nodes over the normal shock, reading the value
+                   function by linear interpolation between grid points (deterministic)
+    'kernel'     - the same interpolated value function integrated exactly with transition_kernel
+                   (deterministic); the kernel is taken
+                   from kernel_cache (a kernel_cache.KernelCache) when one is given
+
+    Clients with shorter horizons are aligned on their goal date: the tables are (clients, max horizon + 1,
+    wealth points), the last row is the terminal value and the rows before a client's start are NaN
+    (see unpad_tables). chunk_size bounds how many clients are held in the working arrays at a time.
+    With a directory the tables are np.memmap files instead of arrays in memory: 'value_tables.npy' and
+    'allocation_tables.npy' in a new 'solve_*' folder inside directory, one folder per call so a later solve never
+    overwrites tables returned before (their .filename gives the path; np.load(..., mmap_mode='r') reads them back).
+    With folder the two files go straight into that folder (created if needed) instead.
+    The files are never deleted here: the folder belongs to the caller, who removes it with remove_tables
+    once the tables are no longer used.
+    Only the current and next time slices are then held in memory and every completed slice is flushed to disk,
+    so memory no longer grows with the horizon.
+    The transition set-up still does not depend on the horizon, but 'kernel' holds an (allocations x wealth x
+    wealth) kernel, so at high grid resolutions use 'quadrature' or 'sample'.
+    Ties (within TIE_TOLERANCE) are resolved to the lowest allocation, as in the original strict '>' comparison.
+    It returns the value tables and the allocation (policy) tables.
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    if transition not in ('sample', 'quadrature', 'kernel'):
+        raise ValueError("Transition must be 'sample', 'quadrature' or 'kernel'.")
+
+    terminal_values = np.atleast_2d(np.asarray(terminal_values, dtype=float))
+    n_clients, n_wealth = terminal_values.shape
+    allocations = np.asarray(allocations, dtype=float)
+    wealth_grids = np.broadcast_to(np.atleast_2d(np.asarray(wealth_grids, dtype=float)), (n_clients, n_wealth))
+    horizons = np.broadcast_to(np.asarray(horizons, dtype=int), (n_clients,))
+    portfolio_mu = np.broadcast_to(np.atleast_2d(np.asarray(portfolio_mu, dtype=float)), (n_clients, len(allocations)))
+    portfolio_sigma = np.broadcast_to(np.atleast_2d(np.asarray(portfolio_sigma, dtype=float)), (n_clients, len(allocations)))
+    cash_flow = np.broadcast_to(np.asarray(cash_flow, dtype=float), (n_clients,))
+    n_steps = int(horizons.max()) if n_clients else 0
+
+    # Every row before the terminal one is written by the backward pass
+    if folder is not None:
+        os.makedirs(folder, exist_ok=True)
+    elif directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        folder = tempfile.mkdtemp(prefix='solve_', dir=directory)
+    value_tables = _new_table((n_clients, n_steps + 1, n_wealth), folder, 'value_tables.npy')
+    value_tables[:, -1, :] = terminal_values
+    allocation_tables = _new_table((n_clients, n_steps + 1, n_wealth), folder, 'allocation_tables.npy')
+    allocation_tables[:, -1, :] = 0
+
+    if not chunk_size:
+        chunk_size = max(n_clients, 1)
+    for first in range(0, n_clients, chunk_size):
+        chunk = slice(first, first + chunk_size)
+        _backward_induction_chunk(value_tables[chunk], allocation_tables[chunk], wealth_grids[chunk],
+                                  n_steps - horizons[chunk], portfolio_mu[chunk], portfolio_sigma[chunk],
+                                  allocations, cash_flow[chunk], rng, transition, n_nodes, kernel_cache)
+
+    return value_tables, allocation_tables
+
+
+def _new_table(shape, folder, name):
+    # An uninitialized array, or a float64 .npy file mapped into memory
+    if folder is None:
+        return np.empty(shape)
+    return np.lib.format.open_memmap(os.path.join(folder, name), mode='w+', dtype=float, shape=shape)
+
+
+# Function to delete the folder of memmap tables
+def remove_tables(tables):
+    '''
+    Deletes the folder holding tables (or a slice of them) written by backward_induction_batch with a directory
+    or folder. The tables must not be used afterwards. Tables held in memory are left alone.
+    '''
+    if isinstance(tables, np.memmap) and tables.filename is not None:
+        shutil.rmtree(os.path.dirname(tables.filename), ignore_errors=True)
+
+
+def _backward_induction_chunk(value_tables, allocation_tables, wealth_grids, start, portfolio_mu, portfolio_sigma,
+                              allocations, cash_flow, rng, transition, n_nodes, kernel_cache):
+    n_clients, n_rows, n_wealth = value_tables.shape
+    clients = np.arange(n_clients)
+
+    # Drift term and invested wealth do not change between time steps
+    drift = portfolio_mu - 0.5 * portfolio_sigma**2
+    invested = (wealth_grids + cash_flow[:, None])[:, :, None]
+
+    # The deterministic modes only depend on the grid and the moments, so they are set up once
+    if transition == 'quadrature':
+        nodes, weights = np.polynomial.hermite.hermgauss(n_nodes)
+        shocks = np.sqrt(2) * nodes
+        node_probs = weights / np.sqrt(np.pi)
+        next_wealth = invested[..., None] * np.exp(drift[:, None, :, None] + portfolio_sigma[:, None, :, None] * shocks)
+        # Quadrature over a step function is poor, so nodes read the value function by linear interpolation
+        next_wealth = np.clip(next_wealth, wealth_grids[:, :1, None, None], wealth_grids[:, -1:, None, None])
+        lower = np.clip(batch_grid_index(wealth_grids, next_wealth), 0, n_wealth - 2)
+        owner = clients[:, None, None, None]
+        frac = (next_wealth - wealth_grids[owner, lower]) / (wealth_grids[owner, lower + 1] - wealth_grids[owner, lower])
+    elif transition == 'kernel':
+        # Clients with the same grid up to scale, moments and cash flow (relative to the grid) share one kernel
+        unit_grids, unit_cash_flow = normalized_grid(wealth_grids, cash_flow)
+        params = np.concatenate([unit_grids, portfolio_mu, portfolio_sigma, unit_cash_flow[:, None]], axis=1)
+        _, first_client, group_of = np.unique(params, axis=0, return_index=True, return_inverse=True)
+        if kernel_cache is not None:
+            kernels = np.stack([kernel_cache.get(wealth_grids[c], portfolio_mu[c], portfolio_sigma[c], cash_flow[c])
+                                for c in first_client])
+        else:
+            kernels = transition_kernel(wealth_grids[first_client], portfolio_mu[first_client],
+                                        portfolio_sigma[first_client], cash_flow[first_client])
+        client_kernels = kernels[group_of.ravel()]
+
+    # Only the slice being computed and the one after it are kept in memory; the tables may be memmaps
+    next_values = np.array(value_tables[:, -1, :])
+    on_disk = isinstance(value_tables, np.memmap)
+    for t in reversed(range(n_rows - 1)):
+        if transition == 'sample':
+            shocks = rng.standard_normal((n_clients, n_wealth, len(allocations)))
+            next_wealth = invested * np.exp(drift[:, None, :] + portfolio_sigma[:, None, :] * shocks)
+            expected = next_values[clients[:, None, None], batch_grid_index(wealth_grids, next_wealth)]
+        elif transition == 'quadrature':
+            interpolated = (1 - frac) * next_values[owner, lower] + frac * next_values[owner, lower + 1]
+            expected = interpolated @ node_probs
+        else:
+            expected = np.einsum('caij,cj->cia', client_kernels, next_values)
+
+        # Clients whose horizon has not started yet at this step keep their NaN padding
+        active = t >= start
+        # Values within TIE_TOLERANCE of the best count as ties, so rounding noise cannot flip the policy
+        best = np.argmax(expected >= expected.max(axis=2, keepdims=True) - TIE_TOLERANCE, axis=2)
+        values = np.where(active[:, None], np.take_along_axis(expected, best[:, :, None], axis=2)[:, :, 0], np.nan)
+        value_tables[:, t, :] = values
+        allocation_tables[:, t, :] = np.where(active[:, None], allocations[best], np.nan)
+        next_values = values
+        if on_disk:
+            value_tables.flush()
+            allocation_tables.flush()
+
+
+# Function to run backward induction over a whole time slice at once
+def backward_induction(terminal_values, wealth_grid, n_steps, portfolio_mu, portfolio_sigma,
+                       allocations=ALLOCATIONS, cash_flow=0.0, rng=None, transition='sample', n_nodes=20,
+                       kernel_cache=None, directory=None, folder=None):
+    '''
+    Single client version of backward_induction_batch (see there for the arguments).
+    It returns the value table and the allocation (policy) table, both shaped (n_steps + 1, wealth points).
+    '''
+    value_tables, allocation_tables = backward_induction_batch(
+        np.asarray(terminal_values, dtype=float)[None, :], np.asarray(wealth_grid, dtype=float)[None, :], [n_steps],
+        portfolio_mu, portfolio_sigma, allocations=allocations, cash_flow=cash_flow, rng=rng,
+        transition=transition, n_nodes=n_nodes, kernel_cache=kernel_cache, directory=directory,
+        folder=folder)
+    return value_tables[0], allocation_tables[0]
+
+
+# Function to strip the alignment padding from batched tables
+def unpad_tables(tables, horizons):
+    '''
+    Returns one table per client from backward_induction_batch output, each starting at the client's time 0
+    and shaped (horizon + 1, wealth points).
+    '''
+    n_steps = tables.shape[1] - 1
+    return [tables[c, n_steps - int(h):] for c, h in enumerate(horizons)]
+
+
+# Function to solve the goal probability DP used in dp.py
+def solve_goal_dp(goal, wealth_grid, months, mu, sigma, cov_matrix, monthly_cash_flow=0.0,
+                  allocations=ALLOCATIONS, rng=None, transition='sample', n_nodes=20, kernel_cache=None,
+                  directory=None, folder=None):
+    '''
+    This function solves the probability of reaching the goal for every (month, wealth) cell.
+    mu, sigma and cov_matrix are the monthly asset parameters (Equity, Debt).
+    The terminal value is 1 where wealth is at or above the goal and 0 elsewhere.
+    transition, n_nodes, kernel_cache, directory and folder (np.memmap storage of the tables) are passed to
+    backward_induction.
+    It returns dp_table and allocation_table in the same layout as dp.py: (months + 1, wealth points).
+    '''
+    wealth_grid = np.asarray(wealth_grid, dtype=float)
+    portfolio_mu, portfolio_sigma = portfolio_moments(allocations, mu, sigma, cov_matrix)
+    terminal_values = (wealth_grid >= goal).astype(int)
+    return backward_induction(terminal_values, wealth_grid, months, portfolio_mu, portfolio_sigma,
+                              allocations=allocations, cash_flow=monthly_cash_flow, rng=rng,
+                              transition=transition, n_nodes=n_nodes, kernel_cache=kernel_cache, directory=directory,
+                              folder=folder)
+
+
+# Function to flatten the allocation table into the optimal strategy table
+def strategy_frame(allocation_table, wealth_grid, months=None):
+    '''
+    This function builds the 'Time', 'Wealth', 'Equity Allocation', 'Debt Allocation' DataFrame written by dp.py
+    (one row per month and wealth point) without a Python loop.
+    '''
+    if months is None:
+        months = allocation_table.shape[0] - 1
+    equity_allocation = allocation_table[:months].ravel()
+    return pd.DataFrame({
+        'Time': np.repeat(np.arange(months), len(wealth_grid)),
+        'Wealth': np.tile(wealth_grid, months),
+        'Equity Allocation': equity_allocation,
+        'Debt Allocation': 1 - equity_allocation,
+    })
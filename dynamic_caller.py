@@ -1,78 +1,40 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
+from dp_engine import ALLOCATIONS, backward_induction_batch, unpad_tables
+from kernel_cache import KernelCache
+from data_loader import load_table
+
+# Batch settings: number of worker processes (1 runs everything in this process) and clients per task
+WORKERS = os.cpu_count()
+CHUNK_SIZE = 64
 
-# Function to get user data from Excel sheet
+# Function to get user data from Excel sheet (or CSV / Parquet); Excel is cached as a Parquet sidecar
 def get_user_data(file_path):
-    return pd.read_excel(file_path)
+    return load_table(file_path, required_columns=['Client', 'Goal Amount', 'Goal Time Horizon', 'Risk Tolerance',
+                                                   'Monthly Investment Capacity'], parquet_cache=True)
 
-# Import the function from the second program (assuming the second program is saved as EF_FR.py)
-from EF_FR import get_best_return_and_risk
+# Import the frontier from the second program (assuming the second program is saved as EF_FR.py)
+from EF_FR import get_frontier
 
 # Define utility function (e.g., exponential utility)
 def utility_function(wealth):
     return np.log(wealth + 1)  # Avoid log(0)
 
-# Define function to compute next wealth using Geometric Brownian Motion (GBM)
-def next_wealth(wealth, allocation, mu, sigma, dt):
-    return wealth * np.exp((mu - 0.5 * sigma**2) * dt + sigma * np.sqrt(dt) * np.random.normal())
-
-# Read user data
-user_data = get_user_data('user_goals.xlsx')
-
-# DataFrame to store monthly investment needed for each client
-monthly_investment_needed_df = pd.DataFrame(columns=['Client', 'Monthly Investment Needed'])
-
-# Loop through each user
-monthly_investment_needed_list = []
-for index, user in user_data.iterrows():
-    client_name = user['Client']
-    initial_wealth = user['Monthly Investment Capacity'] * 12  # Assuming the initial wealth is 12 times the monthly investment
-    target_wealth = user['Goal Amount']
-    investment_horizon = user['Goal Time Horizon']
-    risk_tolerance = user['Risk Tolerance']
-    time_steps = investment_horizon  # Monthly steps
-
-    # Get best return, risk, and portfolio weights based on user risk tolerance
-    best_return, best_risk, portfolio_weights = get_best_return_and_risk(risk_tolerance)
-
-    # Define parameters
-    mu = best_return   # Expected return from previous program
-    sigma = best_risk  # Risk (volatility) from previous program
-
-    # Discretize state space
-    wealth_levels = np.linspace(0, target_wealth, num=21)  # Discretize wealth into 21 levels
-    time_intervals = np.linspace(0, investment_horizon, num=time_steps+1)  # Discretize time
-
-    # Initialize value function array
-    value_function = np.zeros((len(wealth_levels), len(time_intervals)))
-
-    # Set terminal condition
-    value_function[:, -1] = utility_function(wealth_levels)
-
-    # Backward induction to compute the value function
-    for t in reversed(range(len(time_intervals) - 1)):
-        for w in range(len(wealth_levels)):
-            expected_values = []
-            for allocation in np.linspace(0, 1, num=11):  # Different allocations from 0 to 100%
-                next_w = next_wealth(wealth_levels[w], allocation, mu, sigma, time_intervals[1] - time_intervals[0])
-                next_w_index = np.searchsorted(wealth_levels, next_w, side='right') - 1
-                next_w_index = min(next_w_index, len(wealth_levels) - 1)
-                expected_value = value_function[next_w_index, t + 1]
-                expected_values.append(expected_value)
-            value_function[w, t] = np.max(expected_values)
-
-    # Extract optimal policy
-    optimal_policy = np.zeros((len(wealth_levels), len(time_intervals) - 1))
-    for t in range(len(time_intervals) - 1):
-        for w in range(len(wealth_levels)):
-            allocation_values = []
-            for allocation in np.linspace(0, 1, num=11):
-                next_w = next_wealth(wealth_levels[w], allocation, mu, sigma, time_intervals[1] - time_intervals[0])
-                next_w_index = np.searchsorted(wealth_levels, next_w, side='right') - 1
-                next_w_index = min(next_w_index, len(wealth_levels) - 1)
-                expected_value = value_function[next_w_index, t + 1]
-                allocation_values.append(expected_value)
-            optimal_policy[w, t] = np.linspace(0, 1, num=11)[np.argmax(allocation_values)]
+# Define function to get the Geometric Brownian Motion (GBM) step of each allocation
+def step_moments(mu, sigma, dt, allocations):
+    '''
+    Allocation is the share of wealth held in the frontier portfolio, the rest is left uninvested.
+    Returns the per-step drift and volatility of every allocation, as used by dp_engine.backward_induction.
+    '''
+    allocations = np.asarray(allocations, dtype=float)
+    return allocations * mu * dt, allocations * sigma * np.sqrt(dt)
+
+# Function to write the Excel outputs of one user
+def save_client_outputs(index, investment_horizon, wealth_levels, optimal_policy, portfolio_weights, stock_symbols):
+    time_intervals = np.linspace(0, investment_horizon, num=investment_horizon+1)  # Discretize time
 
     # Output the optimal policy
     optimal_policy_df = pd.DataFrame(optimal_policy, columns=[f'Time {t}' for t in range(len(time_intervals) - 1)], index=wealth_levels)
@@ -82,7 +44,6 @@ for index, user in user_data.iterrows():
     print(f"Optimal policy saved to 'optimal_policy_{index}.xlsx'.")
 
     # Align portfolio weights with stock symbols
-    stock_symbols = pd.read_excel('indian_stock_symbols.xlsx')['Symbol'].tolist()
     portfolio_weights = np.array(portfolio_weights)
     if portfolio_weights.ndim == 1:
         portfolio_weights = portfolio_weights.reshape(1, -1)
@@ -110,7 +71,104 @@ for index, user in user_data.iterrows():
     # monthly_investment_needed = total_investment_needed / (investment_horizon * 12)
     # monthly_investment_needed_list.append({'Client': client_name, 'Monthly Investment Needed': monthly_investment_needed})
 
-# # Save the monthly investment needed for each client to an Excel file
-# monthly_investment_needed_df = pd.DataFrame(monthly_investment_needed_list)
-# monthly_investment_needed_df.to_excel("monthly_investment_needed.xlsx", sheet_name='Monthly Investment Needed')
-# print("Monthly investment needed saved to 'monthly_investment_needed.xlsx'.")
+# Function to get the best return, risk, and portfolio weights of every user based on their risk tolerance
+def frontier_portfolios(users):
+    '''
+    The frontier is built once (or loaded from the frontier cache) and every user is a lookup on it.
+    Returns {index: (best_return, best_risk, best_weights)} for the users found on it and {index: error} for the others.
+    '''
+    client_params, errors = {}, {}
+    try:
+        frontier, frontier_error = get_frontier(), None
+    except Exception as e:
+        frontier, frontier_error = None, e
+    for index, user in users.iterrows():
+        try:
+            if frontier is None:
+                raise frontier_error
+            best_weights, best_return, best_risk = frontier.best_portfolio(user['Risk Tolerance'])
+            client_params[index] = (best_return, best_risk, best_weights)
+        except Exception as e:
+            errors[index] = f"Frontier failed: {e}"
+    return client_params, errors
+
+# Function to run the DP and write the outputs for a chunk of users
+def solve_clients(users, client_params, errors=None):
+    '''
+    One batched DP solve and the Excel outputs for every user in the chunk, using the frontier portfolio of each
+    user from client_params (see frontier_portfolios); users not in it keep their error from errors.
+    A failing user does not stop the others. It returns one (index, error) pair per user in input order,
+    with error None when the user succeeded.
+    '''
+    errors = dict(errors or {})
+    solved = users.loc[[index for index in users.index if index in client_params]]
+
+    if len(solved):
+        # Discretize state space: 21 wealth levels up to each goal and one step per horizon unit
+        target_wealth = solved['Goal Amount'].to_numpy(dtype=float)
+        horizons = solved['Goal Time Horizon'].to_numpy(dtype=int)
+        wealth_grids = np.linspace(0, target_wealth, num=21).T
+        mu = np.array([client_params[index][0] for index in solved.index], dtype=float)     # Expected return from previous program
+        sigma = np.array([client_params[index][1] for index in solved.index], dtype=float)  # Risk (volatility) from previous program
+        portfolio_mu, portfolio_sigma = step_moments(mu[:, None], sigma[:, None], 1.0, ALLOCATIONS)
+
+        # Backward induction for all users at once; shorter horizons are aligned on the goal date and unpadded after.
+        # Clients with the same risk bucket and goal share transition kernels.
+        try:
+            value_tables, allocation_tables = backward_induction_batch(utility_function(wealth_grids), wealth_grids, horizons,
+                                                                       portfolio_mu, portfolio_sigma, transition='kernel',
+                                                                       kernel_cache=KernelCache(), chunk_size=2000)
+            allocation_tables = unpad_tables(allocation_tables, horizons)
+            stock_symbols = load_table('indian_stock_symbols.xlsx', required_columns=['Symbol'], parquet_cache=True)['Symbol'].tolist()
+        except Exception as e:
+            errors.update((index, f"DP solve failed: {e}") for index in solved.index)
+        else:
+            for position, index in enumerate(solved.index):
+                try:
+                    save_client_outputs(index, horizons[position], wealth_grids[position],
+                                        allocation_tables[position][:-1].T, client_params[index][2], stock_symbols)
+                except Exception as e:
+                    errors[index] = f"Saving outputs failed: {e}"
+
+    return [(index, errors.get(index)) for index in users.index]
+
+# Function to run every user, spread over worker processes
+def run_clients(user_data, workers=WORKERS, chunk_size=CHUNK_SIZE):
+    '''
+    The frontier is built once here, in this process, and the frontier portfolio of every user is passed to the
+    workers with its chunk. Users are then split into chunks of chunk_size and each chunk is handled by
+    solve_clients in a ProcessPoolExecutor with the given number of workers (workers=1 runs in this process).
+    Results come back in the order of user_data whatever order the workers finish in.
+    If a whole chunk fails (e.g. a worker crashes) its users are reported as failed and the run goes on.
+    '''
+    client_params, errors = frontier_portfolios(user_data)
+    chunks = [user_data.iloc[first:first + chunk_size] for first in range(0, len(user_data), chunk_size)]
+    chunk_args = [(chunk, {index: client_params[index] for index in chunk.index if index in client_params},
+                   {index: errors[index] for index in chunk.index if index in errors}) for chunk in chunks]
+    if workers == 1:
+        return [result for args in chunk_args for result in solve_clients(*args)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(solve_clients, *args) for args in chunk_args]
+        for chunk, future in zip(chunks, futures):
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                results.extend((index, f"Worker failed: {e}") for index in chunk.index)
+    return results
+
+if __name__ == '__main__':
+    # Read user data
+    user_data = get_user_data('user_goals.xlsx')
+
+    results = run_clients(user_data)
+    failed = [(index, error) for index, error in results if error is not None]
+    for index, error in failed:
+        print(f"Client at row {index} failed: {error}")
+    print(f"Processed {len(results)} clients, {len(failed)} failed.")
+
+    # # Save the monthly investment needed for each client to an Excel file
+    # monthly_investment_needed_df = pd.DataFrame(monthly_investment_needed_list)
+    # monthly_investment_needed_df.to_excel("monthly_investment_needed.xlsx", sheet_name='Monthly Investment Needed')
+    # print("Monthly investment needed saved to 'monthly_investment_needed.xlsx'.")
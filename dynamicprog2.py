@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+from dp_engine import ALLOCATIONS, backward_induction, portfolio_moments
 
 
 # Define constants and parameters
@@ -18,47 +19,17 @@ months = T*12 # Total Number of months
 time_steps = np.arange(0, months+1)
 wealth_grid = np.linspace(0, 2*G, 100)
 
-# Initialize dynamic programming table
-dp_table = np.zeros((len(time_steps), len(wealth_grid)))
-dp_table[-1, :] = (wealth_grid >= G).astype(int)  # Final step
-
-# Backward recursion
-for t in reversed(range(T)):
-    for i, W in enumerate(wealth_grid):
-        max_prob = 0
-        for a in np.linspace(0, 1, 11):  # Portfolio allocations
-            # Portfolio mean and variance
-            portfolio_mu = a * mu[0] + (1-a) * mu[1]
-            portfolio_sigma = np.sqrt(a**2 * sigma[0]**2 + (1-a)**2 * sigma[1]**2 + 2*a*(1-a)*cov_matrix[0,1])
-            
-            # Expected wealth at next time step
-            expected_wealth = W * np.exp((portfolio_mu - 0.5 * portfolio_sigma**2) + portfolio_sigma * np.random.normal(0, 1))
-            j = np.searchsorted(wealth_grid, expected_wealth, side='right') - 1
-            j = np.clip(j, 0, len(wealth_grid)-1)
-            
-            # Probability of reaching goal
-            prob = dp_table[t+1, j]
-            max_prob = max(max_prob, prob)
-        
-        dp_table[t, i] = max_prob
+# Backward recursion over T yearly steps (mu and sigma are yearly); the best allocation of every
+# cell is recorded in the same pass, so the strategy always agrees with dp_table
+portfolio_mu, portfolio_sigma = portfolio_moments(ALLOCATIONS, mu, sigma, cov_matrix)
+dp_table, allocation_table = backward_induction((wealth_grid >= G).astype(int), wealth_grid, T,
+                                                portfolio_mu, portfolio_sigma, transition='kernel')
 
 # Optimal strategy
 optimal_strategy = []
 for t in range(T):
     for i, W in enumerate(wealth_grid):
-        max_prob = 0
-        best_allocation = None
-        for a in np.linspace(0, 1, 11):
-            portfolio_mu = a * mu[0] + (1-a) * mu[1]
-            portfolio_sigma = np.sqrt(a**2 * sigma[0]**2 + (1-a)**2 * sigma[1]**2 + 2*a*(1-a)*cov_matrix[0,1])
-            expected_wealth = W * np.exp((portfolio_mu - 0.5 * portfolio_sigma**2) + portfolio_sigma * np.random.normal(0, 1))
-            j = np.searchsorted(wealth_grid, expected_wealth, side='right') - 1
-            j = np.clip(j, 0, len(wealth_grid)-1)
-            prob = dp_table[t+1, j]
-            if prob > max_prob:
-                max_prob = prob
-                best_allocation = a
-        optimal_strategy.append((t, W, best_allocation))
+        optimal_strategy.append((t, W, allocation_table[t, i]))
 
 print("Optimal Strategy:", optimal_strategy)
 
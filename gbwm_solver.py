@@ -46,8 +46,59 @@ def solve(RE_years, RD_years, Years, p_e, p_d, Goal):
     res = minimize(objective, x0, args=(), bounds=bnds, method='SLSQP', constraints=constraints(x0, RE_years, RD_years, p_e, p_d, Goal))
     return (res.x[0]+res.x[1])
 
+# Function to get the future value of investing 1 per month for the given number of years
+def annuity_factor(rate, Years):
+    '''
+    12 * ((1 + rate)^Years - 1) / rate, with its limit 12 * Years when the rate is zero.
+    Works on scalars and NumPy arrays alike.
+    '''
+    rate = np.asarray(rate, dtype=float)
+    Years = np.asarray(Years, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = 12*((((1+rate)**Years)-1)/rate)
+    return np.where(rate == 0, 12*Years, factor)
+
+# Function to solve the goal programming problem for many goals at once
+def goal_programming_solver_batch(RE, RD, Years, p_e, Goal, validate=False):
+    '''
+    The problem solved by solve() is a linear program in (E, D): with S = E + D and E = f * S, the equity
+    constraint only asks for 0 <= f <= p_e, and the goal constraint is S * (f * RE_years + (1 - f) * RD_years) >= Goal.
+    The cheapest S therefore puts f at whichever end of [0, p_e] grows faster:
+        S = Goal / max(p_e * RE_years + p_d * RD_years, RD_years)     (and S = 0 when Goal <= 0)
+    This function evaluates that optimum for NumPy arrays of (RE, RD, Years, p_e, Goal) in one vectorized pass.
+    Rows outside the closed form's assumptions (p_e outside [0, 1] or a non-positive growth factor) fall back
+    to SLSQP. With validate=True every row is also solved with SLSQP and a ValueError is raised if the closed
+    form is ever more expensive (SLSQP can stop short of the optimum, e.g. at the all-debt corner when RD > RE).
+    It returns an array with the minimum monthly investment of every row.
+    '''
+    RE, RD, Years, p_e, Goal = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (RE, RD, Years, p_e, Goal)))
+    p_d = 1 - p_e
+    RE_years = annuity_factor(RE, Years)
+    RD_years = annuity_factor(RD, Years)
+    growth = np.maximum(p_e*RE_years + p_d*RD_years, RD_years)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        solution = np.where(Goal > 0, Goal / growth, 0.0)
+
+    fallback = ~((p_e >= 0) & (p_e <= 1) & (growth > 0) & np.isfinite(growth))
+    for i in map(tuple, np.argwhere(fallback)):
+        solution[i] = solve(RE_years[i], RD_years[i], Years[i], p_e[i], p_d[i], Goal[i])
+
+    if validate:
+        for i in np.ndindex(solution.shape):
+            reference = solve(RE_years[i], RD_years[i], Years[i], p_e[i], p_d[i], Goal[i])
+            if solution[i] > reference * (1 + 1e-6) + 1e-6:
+                raise ValueError(f"Closed form {solution[i]} is above SLSQP {reference} for row {i}.")
+    return solution
+
 # Function to solve the goal programming problem
-def goal_programming_solver(RE, RD, Years, p_e, Goal):
+def goal_programming_solver(RE, RD, Years, p_e, Goal, method='closed_form'):
+    '''
+    method='closed_form' uses goal_programming_solver_batch; method='slsqp' runs the numerical optimizer.
+    '''
+    if method == 'closed_form':
+        return float(goal_programming_solver_batch(RE, RD, Years, p_e, Goal))
+    elif method != 'slsqp':
+        raise ValueError("Method must be 'closed_form' or 'slsqp'.")
     p_d = 1 - p_e
     # Getting the original solution
     RE_years = 12*((((1+RE)**Years)-1)/RE)
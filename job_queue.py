@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+def _connect(db_path):
+    connection = sqlite3.connect(db_path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+def _set_status(db_path, job_id, status, error=None):
+    with _connect(db_path) as connection:
+        connection.execute('UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?',
+                           (status, error, time.time() if status in ('finished', 'failed') else None, job_id))
+
+
+# Function to tell whether the server process that queued a job is still running
+def _process_alive(pid):
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows; assume it is alive so its jobs are never failed by mistake
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Function run inside a worker process for one job
+def _run_job(db_path, job_id, handler, input_path, output_path):
+    _set_status(db_path, job_id, 'running')
+    try:
+        handler(input_path, output_path)
+    except Exception as e:
+        _set_status(db_path, job_id, 'failed', f'{type(e).__name__}: {e}')
+    else:
+        _set_status(db_path, job_id, 'finished')
+
+
+class JobQueue:
+    '''
+    A local job queue for long running uploads, with no outside broker.
+    Jobs are recorded in a SQLite database, their input and output files are kept in the same directory,
+    and a ProcessPoolExecutor with the given number of workers runs them in the background.
+    handler(input_path, output_path) does the actual work and must be a module level function.
+    Finished and failed jobs are removed, files included, ttl seconds after they finish.
+    Every job records the pid of the process whose executor runs it (its owner). Several server processes
+    (gunicorn workers, the Flask reloader) can share the directory: on start a queue only fails the pending jobs
+    whose owner is no longer running, never the jobs another live process is still working on.
+    A worker that dies (e.g. out of memory) breaks a ProcessPoolExecutor for good: the jobs it held are marked
+    failed and the queue carries on with a new pool.
+    '''
+
+    def __init__(self, directory='jobs', workers=2, ttl=24 * 3600):
+        self.directory = directory
+        self.ttl = ttl
+        self.db_path = os.path.join(directory, 'jobs.sqlite3')
+        os.makedirs(directory, exist_ok=True)
+        with _connect(self.db_path) as connection:
+            connection.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                      id TEXT PRIMARY KEY, status TEXT, created REAL, finished REAL,
+                                      input_path TEXT, output_path TEXT, download_name TEXT, error TEXT,
+                                      owner INTEGER)''')
+            if 'owner' not in [row['name'] for row in connection.execute('PRAGMA table_info(jobs)')]:
+                connection.execute('ALTER TABLE jobs ADD COLUMN owner INTEGER')
+            # Pending jobs whose owner has stopped will never finish
+            pending = connection.execute("SELECT id, owner FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+            orphaned = [(time.time(), row['id']) for row in pending if not _process_alive(row['owner'])]
+            connection.executemany("UPDATE jobs SET status = 'failed', error = 'Interrupted by a restart', finished = ? "
+                                   "WHERE id = ?", orphaned)
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, input_bytes, handler, input_suffix='', download_name='output'):
+        '''
+        Stores the input, queues the job and returns its id straight away.
+        '''
+        self.purge_expired()
+        job_id = uuid.uuid4().hex
+        input_path = os.path.join(self.directory, f'{job_id}_input{input_suffix}')
+        output_path = os.path.join(self.directory, f'{job_id}_output')
+        with open(input_path, 'wb') as f:
+            f.write(input_bytes)
+        with _connect(self.db_path) as connection:
+            connection.execute('INSERT INTO jobs (id, status, created, input_path, output_path, download_name, owner) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (job_id, 'queued', time.time(), input_path, output_path, download_name, os.getpid()))
+
+        # A pool broken by a dead worker is replaced once; if the new pool fails too the job is marked failed
+        for attempt in range(2):
+            executor = self._executor
+            try:
+                future = executor.submit(_run_job, self.db_path, job_id, handler, input_path, output_path)
+            except BrokenProcessPool as e:
+                self._replace_executor(executor)
+                if attempt:
+                    _set_status(self.db_path, job_id, 'failed', f'Worker failed: {e}')
+            else:
+                future.add_done_callback(lambda done: self._record_crash(job_id, executor, done))
+                break
+        return job_id
+
+    def status(self, job_id):
+        '''
+        Returns the job record as a dict, or None for an unknown (or expired) job.
+        '''
+        self.purge_expired()
+        with _connect(self.db_path) as connection:
+            row = connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl
+        with _connect(self.db_path) as connection:
+            expired = connection.execute('SELECT id, input_path, output_path FROM jobs WHERE finished < ?',
+                                         (cutoff,)).fetchall()
+            for row in expired:
+                for path in (row['input_path'], row['output_path']):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            connection.executemany('DELETE FROM jobs WHERE id = ?', [(row['id'],) for row in expired])
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _replace_executor(self, broken):
+        # Only the first caller for a broken pool replaces it
+        with self._lock:
+            if self._executor is broken:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                broken.shutdown(wait=False)
+
+    def _record_crash(self, job_id, executor, future):
+        # _run_job records its own errors; this only catches workers that died (e.g. out of memory)
+        if not future.cancelled() and future.exception() is not None:
+            _set_status(self.db_path, job_id, 'failed', f'Worker failed: {future.exception()}')
+            if isinstance(future.exception(), BrokenProcessPool):
+                self._replace_executor(executor)
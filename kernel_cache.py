@@ -0,0 +1,86 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from dp_engine import normalized_grid, transition_kernel
+
+# Part of every key, so kernels stored by an older transition_kernel are never read back
+KERNEL_VERSION = 2
+
+
+class KernelCache:
+    '''
+    Transition kernels (see dp_engine.transition_kernel) only depend on the wealth grid, the per-allocation
+    portfolio moments and the cash flow, so clients in the same risk bucket share them.
+    Kernels are also the same for grids that only differ in scale, so keys use the grid and cash flow
+    relative to the top of the grid (see dp_engine.normalized_grid): every goal amount on linspace(0, goal, n)
+    shares one entry.
+    This class keeps recently used kernels in memory and every kernel on disk as a .npy file.
+    Disk entries are evicted least recently used first once there are more than max_entries of them;
+    the file modification time records the last use (memory hits included).
+    '''
+
+    def __init__(self, directory='kernel_cache', max_entries=64, memory_entries=8):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(wealth_grid, portfolio_mu, portfolio_sigma, cash_flow=0.0):
+        digest = hashlib.sha256(f'v{KERNEL_VERSION}|'.encode())
+        unit_grid, unit_cash_flow = normalized_grid(wealth_grid, cash_flow)
+        for values in (unit_grid, portfolio_mu, portfolio_sigma, [unit_cash_flow]):
+            digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+            digest.update(b'|')
+        return digest.hexdigest()
+
+    def get(self, wealth_grid, portfolio_mu, portfolio_sigma, cash_flow=0.0):
+        '''
+        Returns the kernel for these parameters, computing and storing it only on a cache miss.
+        '''
+        key = self.key(wealth_grid, portfolio_mu, portfolio_sigma, cash_flow)
+        path = os.path.join(self.directory, f'{key}.npy')
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return self._memory[key]
+
+        try:
+            kernel = np.load(path)
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            kernel = transition_kernel(wealth_grid, portfolio_mu, portfolio_sigma, cash_flow)
+            # Write to a temporary file first so parallel workers never read a half written kernel
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, kernel)
+            os.replace(tmp_path, path)
+            self._evict()
+
+        self._memory[key] = kernel
+        if len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+        return kernel
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    continue
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -1,3 +1,5 @@
+from sip_calculator import minimum_sip
+
 def calculate_minimum_investment(A, EYR, DYR, Y, dt_per, eq_per, goal_amount):
     '''
     A = Total monthly investment value
@@ -8,19 +10,10 @@ def calculate_minimum_investment(A, EYR, DYR, Y, dt_per, eq_per, goal_amount):
     eq_per = Share of total investment into Equity
     goal_amount = Goal Maturity amount after inflation
     '''
-    #Convert EMR and DMR into monthly interest value. Convert Maturity year to toal months to Mature
-    EMR = EYR / 12 / 100
-    DMR = DYR / 12 / 100
-    M = Y * 12
-
-    # Loop to find out minimum investment needed to achive goal maturity amount
-    
-    for i in range(1, A):
-        FV = ((i * (dt_per / 100)) * ((((1 + DMR) ** (M)) - 1) * (1 + DMR)) / DMR) + (
-                (i * (eq_per / 100)) * ((((1 + EMR) ** (M)) - 1) * (1 + EMR)) / EMR)
-        FV = round(FV)
-        if FV >= goal_amount:
-            return i, FV
+    # Find the minimum investment needed to achive goal maturity amount (same answer as looping i = 1 .. A - 1)
+    i, FV = minimum_sip(A, EYR, DYR, Y, dt_per, eq_per, goal_amount, upper=A - 1)
+    if FV is not None:
+        return i, FV
     return A
 
 # Take input from user
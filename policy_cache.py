@@ -0,0 +1,136 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from dp_engine import ALLOCATIONS, remove_tables, solve_goal_dp
+from kernel_cache import KERNEL_VERSION
+
+# Part of every key, so tables stored by an older backward induction are never read back
+TABLE_VERSION = 1
+
+
+class GoalPolicyCache:
+    '''
+    The GBM step scales with wealth, so the goal probability DP for goal G on linspace(0, grid_multiple * G)
+    with cash flow c is the same problem as goal 1 on linspace(0, grid_multiple) with cash flow c / G.
+    This class solves in those goal-normalized units and memoizes the tables by
+    (horizon, mu, sigma, cov, contribution ratio, allocation set, grid, transition), so every goal amount
+    with the same risk bucket, horizon and contribution ratio reuses one solve.
+    Without a directory up to max_entries solves are kept in memory, least recently used first out.
+    With a directory every solve is also stored there as a folder named after the key holding
+    'value_tables.npy' and 'allocation_tables.npy' (read back as np.memmap), so later runs and other processes
+    reuse it too. Disk entries are evicted least recently used first once there are more than max_entries of them;
+    the folder modification time records the last use. Tables returned before must not be used after their
+    entry is evicted.
+    '''
+
+    def __init__(self, max_entries=256, kernel_cache=None, directory=None, memory_entries=8):
+        self.max_entries = max_entries
+        self.kernel_cache = kernel_cache
+        self.directory = directory
+        self.memory_entries = memory_entries if directory is not None else max_entries
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(months, mu, sigma, cov_matrix, contribution_ratio, allocations, n_points, grid_multiple, transition,
+            n_nodes):
+        key = (int(months), tuple(np.ravel(mu).astype(float)), tuple(np.ravel(sigma).astype(float)),
+               tuple(np.ravel(cov_matrix).astype(float)), float(contribution_ratio),
+               tuple(np.asarray(allocations, dtype=float)), int(n_points), float(grid_multiple), transition,
+               int(n_nodes))
+        return hashlib.sha256(f'v{KERNEL_VERSION}.{TABLE_VERSION}|{key!r}'.encode()).hexdigest()
+
+    def solve(self, goal, months, mu, sigma, cov_matrix, monthly_cash_flow=0.0, allocations=ALLOCATIONS,
+              n_points=100, grid_multiple=2, transition='kernel', n_nodes=20):
+        '''
+        Same inputs and tables as dp_engine.solve_goal_dp on the grid linspace(0, grid_multiple * goal, n_points).
+        It returns wealth_grid, dp_table and allocation_table. The tables are shared between callers and read only.
+        '''
+        allocations = np.asarray(allocations, dtype=float)
+        contribution_ratio = monthly_cash_flow / goal
+        key = self.key(months, mu, sigma, cov_matrix, contribution_ratio, allocations, n_points, grid_multiple,
+                       transition, n_nodes)
+        unit_grid = np.linspace(0, grid_multiple, n_points)
+
+        if key in self._tables:
+            self.hits += 1
+            self._tables.move_to_end(key)
+            self._touch(key)
+        else:
+            tables = self._load(key)
+            if tables is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                tables = self._solve(key, unit_grid, months, mu, sigma, cov_matrix, contribution_ratio, allocations,
+                                     transition, n_nodes)
+            self._tables[key] = tables
+            if len(self._tables) > self.memory_entries:
+                self._tables.popitem(last=False)
+
+        dp_table, allocation_table = self._tables[key]
+        return goal * unit_grid, dp_table, allocation_table
+
+    def _solve(self, key, unit_grid, months, mu, sigma, cov_matrix, contribution_ratio, allocations, transition,
+               n_nodes):
+        if self.directory is None:
+            dp_table, allocation_table = solve_goal_dp(1.0, unit_grid, months, mu, sigma, cov_matrix,
+                                                       contribution_ratio, allocations=allocations,
+                                                       transition=transition, n_nodes=n_nodes,
+                                                       kernel_cache=self.kernel_cache)
+            dp_table.flags.writeable = False
+            allocation_table.flags.writeable = False
+            return dp_table, allocation_table
+
+        # Solve into a temporary folder first so parallel processes never read half written tables
+        folder = tempfile.mkdtemp(prefix=f'{key}.', suffix='.tmp', dir=self.directory)
+        dp_table = solve_goal_dp(1.0, unit_grid, months, mu, sigma, cov_matrix, contribution_ratio,
+                                 allocations=allocations, transition=transition, n_nodes=n_nodes,
+                                 kernel_cache=self.kernel_cache, folder=folder)[0]
+        try:
+            os.rename(folder, os.path.join(self.directory, key))
+        except OSError:
+            # Another process stored the same solve first
+            remove_tables(dp_table)
+        self._evict()
+        return self._load(key)
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        folder = os.path.join(self.directory, key)
+        try:
+            tables = (np.load(os.path.join(folder, 'value_tables.npy'), mmap_mode='r')[0],
+                      np.load(os.path.join(folder, 'allocation_tables.npy'), mmap_mode='r')[0])
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        self._touch(key)
+        return tables
+
+    def _touch(self, key):
+        if self.directory is not None:
+            try:
+                os.utime(os.path.join(self.directory, key))
+            except OSError:
+                pass
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.tmp') and os.path.isdir(path):
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    continue
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+from datetime import date, timedelta
+
+import pandas as pd
+
+from data_loader import load_table
+
+
+class YahooFetcher:
+    '''
+    Daily adjusted closing prices from Yahoo Finance, one batched download for all symbols of a request.
+    '''
+
+    def __init__(self, interval='1d'):
+        self.interval = interval
+
+    def fetch(self, symbols, start, end):
+        '''
+        Returns a DataFrame indexed by date with one column per symbol, for start <= date < end.
+        Symbols Yahoo has no data for are left out.
+        '''
+        import yfinance as yf
+
+        data = yf.download(list(symbols), start=start, end=end, interval=self.interval, auto_adjust=False,
+                           progress=False)['Adj Close']
+        if isinstance(data, pd.Series):
+            data = data.to_frame(symbols[0])
+        return data.dropna(axis=1, how='all')
+
+
+class FileFetcher:
+    '''
+    Prices from a local Excel / CSV / Parquet file with a 'Date' column and one column per symbol,
+    for running without network access (tests, offline machines).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, symbols, start, end):
+        data = load_table(self.path, required_columns=['Date'])
+        data = data.set_index(pd.to_datetime(data.pop('Date'))).sort_index()
+        data = data.loc[(data.index >= pd.Timestamp(start)) & (data.index < pd.Timestamp(end))]
+        return data[[symbol for symbol in symbols if symbol in data.columns]]
+
+
+class PriceStore:
+    '''
+    Local store of daily prices keyed by symbol and date, kept in a SQLite database.
+    For every symbol it also records the date range already fetched, so a request only fetches the dates
+    before or after that range. The fetcher (YahooFetcher by default) is called once per distinct missing range,
+    with all symbols missing that range together.
+    With offline=True nothing is fetched and requests are answered from the stored prices only.
+    '''
+
+    def __init__(self, path=os.path.join('price_store', 'prices.sqlite3'), fetcher=None, offline=False):
+        self.path = path
+        self.fetcher = fetcher if fetcher is not None else YahooFetcher()
+        self.offline = offline
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS prices (symbol TEXT, date TEXT, price REAL, PRIMARY KEY (symbol, date))')
+            connection.execute('CREATE TABLE IF NOT EXISTS coverage (symbol TEXT PRIMARY KEY, start TEXT, end TEXT)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def missing_ranges(self, symbols, start, end):
+        '''
+        Returns {(range_start, range_end): [symbols]} for the dates in [start, end) not fetched yet.
+        '''
+        with self._connect() as connection:
+            coverage = {symbol: (covered_start, covered_end) for symbol, covered_start, covered_end
+                        in connection.execute('SELECT symbol, start, end FROM coverage')}
+        missing = {}
+        for symbol in symbols:
+            if symbol not in coverage:
+                ranges = [(start, end)]
+            else:
+                covered_start, covered_end = coverage[symbol]
+                ranges = [(start, covered_start)] if start < covered_start else []
+                if end > covered_end:
+                    ranges.append((covered_end, end))
+            for date_range in ranges:
+                missing.setdefault(date_range, []).append(symbol)
+        return missing
+
+    def refresh(self, symbols, start, end):
+        '''
+        Fetches and stores the prices of [start, end) (ISO dates) that are not in the store yet.
+        A failed fetch is reported and leaves the store as it was, so the range is tried again next time.
+        After a successful fetch the whole range counts as covered for every requested symbol, even those without
+        prices (delisted symbols, weekends and holidays), so they are not fetched again on every request.
+        '''
+        for (range_start, range_end), range_symbols in self.missing_ranges(symbols, start, end).items():
+            print(f"Fetching prices for {len(range_symbols)} symbols from {range_start} to {range_end}...")
+            try:
+                data = self.fetcher.fetch(range_symbols, range_start, range_end)
+            except Exception as e:
+                print(f"Error fetching prices for {', '.join(range_symbols)}: {e}")
+                continue
+
+            rows = data.rename_axis('date').reset_index().melt(id_vars='date', var_name='symbol', value_name='price').dropna()
+            rows['date'] = pd.to_datetime(rows['date']).dt.strftime('%Y-%m-%d')
+            with self._connect() as connection:
+                connection.executemany('INSERT OR REPLACE INTO prices (symbol, date, price) VALUES (?, ?, ?)',
+                                       rows[['symbol', 'date', 'price']].itertuples(index=False, name=None))
+                for symbol in range_symbols:
+                    connection.execute('''INSERT INTO coverage (symbol, start, end) VALUES (?, ?, ?)
+                                          ON CONFLICT (symbol) DO UPDATE SET start = MIN(start, excluded.start),
+                                                                             end = MAX(end, excluded.end)''',
+                                       (symbol, range_start, range_end))
+
+    def prices(self, symbols, start, end=None):
+        '''
+        Returns a DataFrame indexed by date with one column per symbol, for start <= date < end
+        (end defaults to today, so only complete days are stored). Missing dates are fetched first unless offline.
+        Symbols without any price are left out.
+        '''
+        start = pd.Timestamp(start).strftime('%Y-%m-%d')
+        end = pd.Timestamp(end if end is not None else date.today()).strftime('%Y-%m-%d')
+        if not self.offline:
+            self.refresh(symbols, start, end)
+
+        placeholders = ','.join('?' * len(symbols))
+        with self._connect() as connection:
+            rows = pd.read_sql_query(f'SELECT symbol, date, price FROM prices WHERE symbol IN ({placeholders}) '
+                                     'AND date >= ? AND date < ?', connection, params=[*symbols, start, end])
+        data = rows.pivot(index='date', columns='symbol', values='price')
+        data.index = pd.to_datetime(data.index)
+        return data[[symbol for symbol in symbols if symbol in data.columns]].rename_axis(columns=None)
+
+    def history(self, symbols, years=5):
+        '''
+        Same as prices for the last years years, like yfinance's period='5y'.
+        '''
+        return self.prices(symbols, date.today() - timedelta(days=round(365.25 * years)))
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+# Bump when the calculation changes so results computed by older code are never served
+CACHE_VERSION = 1
+
+# SQLite limits the number of parameters in one statement
+_BATCH = 500
+
+
+class ResultCache:
+    '''
+    Results of repeated uploads, kept in a local SQLite database at two levels:
+    whole workbooks (the finished output file, keyed by the normalized input and the output format) and
+    single client rows (the per-goal results of one row, keyed by the normalized values of that row only).
+    An unchanged workbook is served as is; in a changed one only the new or edited rows are recomputed.
+    Entries are evicted least recently used first once their total size passes max_bytes.
+    '''
+
+    def __init__(self, directory='result_cache', max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.db_path = os.path.join(directory, 'results.sqlite3')
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    @staticmethod
+    def normalize(data, columns):
+        '''
+        The input values the results depend on: the given columns in that order, as floats.
+        Other columns, the column order and int/float differences do not change the normalized rows.
+        '''
+        return data[list(columns)].astype(np.float64)
+
+    @staticmethod
+    def row_keys(normalized, *extra):
+        '''
+        One key per row of a normalized frame. extra (e.g. the reserve flag) goes into every key.
+        '''
+        salt = hashlib.sha256(repr((CACHE_VERSION, list(normalized.columns)) + extra).encode()).hexdigest()[:16]
+        hashes = pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+        return [f'row:{salt}:{value:016x}' for value in hashes]
+
+    @staticmethod
+    def workbook_key(normalized, index, *extra):
+        digest = hashlib.sha256(repr((CACHE_VERSION, list(normalized.columns)) + extra).encode())
+        digest.update(pd.util.hash_pandas_object(normalized, index=False).to_numpy().tobytes())
+        digest.update(pd.util.hash_pandas_object(pd.Series(index), index=False).to_numpy().tobytes())
+        return f'workbook:{digest.hexdigest()}'
+
+    def get_many(self, keys):
+        '''
+        Returns {key: bytes} for the keys that are in the cache and marks them as used.
+        '''
+        found = {}
+        with self._connect() as connection:
+            for first in range(0, len(keys), _BATCH):
+                batch = keys[first:first + _BATCH]
+                placeholders = ','.join('?' * len(batch))
+                found.update(connection.execute(f'SELECT key, value FROM entries WHERE key IN ({placeholders})', batch))
+            connection.executemany('UPDATE entries SET used = ? WHERE key = ?', [(time.time(), key) for key in found])
+        self.hits += len(found)
+        self.misses += len(set(keys)) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        '''
+        Stores (key, bytes) pairs, then evicts the least recently used entries above max_bytes.
+        '''
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany('INSERT OR REPLACE INTO entries (key, value, size, used) VALUES (?, ?, ?, ?)',
+                                   [(key, value, len(value), now) for key, value in items])
+        self._evict()
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def _evict(self):
+        with self._connect() as connection:
+            total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            stale = []
+            for key, size in connection.execute('SELECT key, size FROM entries ORDER BY used'):
+                if total <= self.max_bytes:
+                    break
+                stale.append((key,))
+                total -= size
+            connection.executemany('DELETE FROM entries WHERE key = ?', stale)
@@ -0,0 +1,480 @@
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from data_loader import load_table
+
+EQUITY_PATH = 'Historical_Equity.xlsx'
+DEBT_PATH = 'Historical_Debt.xlsx'
+
+# Lookback windows in years (None is the full history) and the one used when none is asked for
+WINDOWS = (1, 3, 5, 10, None)
+DEFAULT_WINDOW = 10
+PERIODS_PER_YEAR = {'daily': 252, 'monthly': 12}
+
+
+# Function to load one (Date, value) series of a history file, oldest first
+@lru_cache(maxsize=8)
+def _load_series(path, date_column, value_column, date_format, modified):
+    # modified (the file's mtime) is only part of the cache key, so an edited file is read again
+    sidecar = f'{path}.{value_column}.parquet'
+    try:
+        if os.path.getmtime(sidecar) >= modified:
+            data = pd.read_parquet(sidecar)
+            return pd.Series(data[value_column].to_numpy(), index=pd.DatetimeIndex(data[date_column]), name=value_column)
+    except (OSError, ImportError, ValueError, KeyError):
+        pass
+
+    data = load_table(path, required_columns=[date_column, value_column])
+    data = pd.DataFrame({date_column: pd.to_datetime(data[date_column], format=date_format),
+                         value_column: data[value_column].astype(float)}).sort_values(date_column)
+    try:
+        # Only the two columns are kept, so the sidecar can be written even when other columns mix types
+        tmp_path = f'{sidecar}.{os.getpid()}.tmp'
+        data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, sidecar)
+    except Exception:
+        pass
+    return pd.Series(data[value_column].to_numpy(), index=pd.DatetimeIndex(data[date_column]), name=value_column)
+
+
+def load_series(path, date_column, value_column, date_format=None):
+    '''
+    Returns the value column of a history file as a Series indexed by date, oldest first.
+    Each file is read once per process; the two columns are also kept as a Parquet sidecar
+    ('<file>.<column>.parquet') that later processes read instead of the workbook while it is up to date.
+    '''
+    return _load_series(path, date_column, value_column, date_format, os.path.getmtime(path)).copy()
+
+
+# Function to build daily levels of both assets that returns can be taken from
+def asset_levels(equity_path=EQUITY_PATH, debt_path=DEBT_PATH, debt_duration=0.0):
+    '''
+    Equity: the Close of Historical_Equity.xlsx.
+    Debt: Historical_Debt.xlsx holds a bond yield in %, so the debt level is a total return index that accrues
+    the yield between observations, minus debt_duration times each change in yield (0 keeps the carry only).
+    Returns a DataFrame with 'Equity' and 'Debt' columns on the dates both series have.
+    '''
+    equity = load_series(equity_path, 'Date', 'Close', '%d-%b-%y')
+    debt = debt_index(load_series(debt_path, 'Date', 'Price') / 100, debt_duration)
+    return pd.DataFrame({'Equity': equity, 'Debt': debt}).dropna()
+
+
+# Function to turn debt yields into the total return index of asset_levels
+def debt_index(debt_yield, debt_duration=0.0, previous=None):
+    '''
+    debt_yield is a Series of yields (as decimals) by date, oldest first.
+    previous = (date, yield, level) of the row just before debt_yield continues an index built earlier;
+    without it the index starts at 1 on the first date.
+    '''
+    dates, yields, start = debt_yield.index, debt_yield.to_numpy(dtype=float), 1.0
+    if previous is not None:
+        dates = dates.insert(0, pd.Timestamp(previous[0]))
+        yields = np.concatenate([[previous[1]], yields])
+        start = previous[2]
+    days = np.diff(dates.to_numpy()).astype('timedelta64[D]').astype(float)
+    growth = (1 + yields[:-1] * days / 365) * (1 - debt_duration * np.diff(yields))
+    levels = start * np.concatenate([[1.0], np.cumprod(growth)])
+    if previous is not None:
+        levels = levels[1:]
+    return pd.Series(levels, index=debt_yield.index)
+
+
+# Function to get the last value of every month from a daily series or frame in any date order
+def month_end(levels):
+    levels = levels.sort_index()
+    return levels.groupby(levels.index.to_period('M')).last()
+
+
+# Function to get simple or log returns of the levels, daily or monthly
+def returns(levels, frequency='monthly', kind='simple'):
+    if frequency == 'monthly':
+        levels = month_end(levels)
+    elif frequency != 'daily':
+        raise ValueError("Frequency must be 'daily' or 'monthly'.")
+    if kind == 'log':
+        return np.log(levels).diff().dropna()
+    if kind == 'simple':
+        return levels.pct_change().dropna()
+    raise ValueError("Return kind must be 'simple' or 'log'.")
+
+
+# Function to compute the statistics of every lookback window in one pass
+def window_statistics(asset_returns, periods_per_year, windows=WINDOWS):
+    '''
+    Annualized mean and volatility of both assets and their correlation over the last years of each window.
+    Running sums of r, r^2 and the cross product are taken once; each window is then a difference of two rows.
+    Windows longer than the history use the whole history.
+    '''
+    values = asset_returns[['Equity', 'Debt']].to_numpy(dtype=float)
+    n = len(values)
+    sums = np.zeros((n + 1, 5))
+    sums[1:] = np.cumsum(np.column_stack([values, values**2, values[:, 0] * values[:, 1]]), axis=0)
+
+    counts = np.array([n if years is None else min(n, int(round(years * periods_per_year))) for years in windows])
+    totals = sums[n] - sums[n - counts]
+    mean = totals[:, :2] / counts[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = (totals[:, 2:4] - counts[:, None] * mean**2) / (counts[:, None] - 1)
+        covariance = (totals[:, 4] - counts * mean[:, 0] * mean[:, 1]) / (counts - 1)
+        correlation = covariance / np.sqrt(variance[:, 0] * variance[:, 1])
+    volatility = np.sqrt(np.maximum(variance, 0))
+
+    return pd.DataFrame({
+        'equity_mean': mean[:, 0] * periods_per_year,
+        'equity_vol': volatility[:, 0] * np.sqrt(periods_per_year),
+        'debt_mean': mean[:, 1] * periods_per_year,
+        'debt_vol': volatility[:, 1] * np.sqrt(periods_per_year),
+        'correlation': correlation,
+        'observations': counts,
+    }, index=pd.Index(['full' if years is None else years for years in windows], name='window'))
+
+
+def _monthly_moments(row):
+    # (mu, sigma, cov_matrix) per month from a row of annualized monthly simple return statistics
+    mu = np.array([row['equity_mean'], row['debt_mean']]) / 12
+    sigma = np.array([row['equity_vol'], row['debt_vol']]) / np.sqrt(12)
+    corr_matrix = np.array([[1, row['correlation']], [row['correlation'], 1]])
+    return mu, sigma, np.outer(sigma, sigma) * corr_matrix
+
+
+def _annual_returns(row):
+    # (RE, RD) from a row of annualized log return statistics
+    return float(np.expm1(row['equity_mean'])), float(np.expm1(row['debt_mean']))
+
+
+class ReturnStatistics:
+    '''
+    Return statistics of the equity and debt histories, for every frequency ('daily', 'monthly'),
+    return kind ('simple', 'log') and lookback window, in one table indexed by (frequency, kind, window).
+    Means and volatilities are annualized (252 trading days, 12 months).
+    The helper methods turn a row into the inputs used elsewhere: monthly (mu, sigma, cov_matrix) for dp.py and
+    annual compound rates (RE, RD) for gbwm_solver and the Streamlit apps.
+    '''
+
+    def __init__(self, levels, windows=WINDOWS):
+        self.levels = levels
+        self.windows = tuple(windows)
+        self.returns = {(frequency, kind): returns(levels, frequency, kind)
+                        for frequency in PERIODS_PER_YEAR for kind in ('simple', 'log')}
+        self.table = pd.concat({key: window_statistics(asset_returns, PERIODS_PER_YEAR[key[0]], self.windows)
+                                for key, asset_returns in self.returns.items()}, names=['frequency', 'kind'])
+
+    def row(self, window=DEFAULT_WINDOW, frequency='monthly', kind='simple'):
+        return self.table.loc[(frequency, kind, 'full' if window is None else window)]
+
+    def monthly_moments(self, window=DEFAULT_WINDOW):
+        '''
+        Monthly mean, volatility and covariance matrix of simple returns, ordered (Equity, Debt) as in dp_engine.
+        '''
+        return _monthly_moments(self.row(window))
+
+    def annual_returns(self, window=DEFAULT_WINDOW):
+        '''
+        Compound annual growth rates (RE, RD): exp(annualized mean log return) - 1.
+        '''
+        return _annual_returns(self.row(window, kind='log'))
+
+
+# Function to get the statistics of the history files, computed once per process and file version
+def get_return_statistics(equity_path=EQUITY_PATH, debt_path=DEBT_PATH, debt_duration=0.0, windows=WINDOWS):
+    return _get_return_statistics(equity_path, debt_path, debt_duration, tuple(windows),
+                                  os.path.getmtime(equity_path), os.path.getmtime(debt_path))
+
+
+@lru_cache(maxsize=4)
+def _get_return_statistics(equity_path, debt_path, debt_duration, windows, equity_modified, debt_modified):
+    return ReturnStatistics(asset_levels(equity_path, debt_path, debt_duration), windows)
+
+
+# Function to get (RE, RD) defaults for the input forms, falling back when the history files are not there
+def default_annual_returns(window=DEFAULT_WINDOW, fallback=(0.11, 0.07)):
+    try:
+        return get_return_statistics().annual_returns(window)
+    except (OSError, ValueError, KeyError):
+        return fallback
+
+
+# Half-lives (years) of the exponentially weighted estimates kept by OnlineStatistics, and where its state is saved
+HALFLIVES = (1, 3)
+ONLINE_STATE_FILE = 'return_stats_state.json'
+
+
+class RunningMoments:
+    '''
+    Weighted mean and covariance of a stream of return vectors, updated a batch of rows at a time.
+    A row seen k rows ago has weight decay**k, so decay=1 weights all rows equally (the sample statistics) and
+    decay=0.5**(1/halflife) gives exponentially weighted ones.
+    The state is the weight sum, the sum of squared weights, the mean and the sum of weighted cross deviations.
+    A batch is merged into it with the pairwise update of Chan, Golub and LeVeque (Welford's update, a batch at a time),
+    so an update costs O(rows in the batch) whatever the length of the history.
+    '''
+
+    def __init__(self, n_assets=2, decay=1.0):
+        self.decay = decay
+        self.count = 0
+        self.weight = 0.0
+        self.weight_squares = 0.0
+        self.mean = np.zeros(n_assets)
+        self.comoments = np.zeros((n_assets, n_assets))
+
+    def update(self, rows):
+        rows = np.asarray(rows, dtype=float).reshape(-1, len(self.mean))
+        n = len(rows)
+        if not n:
+            return self
+        weights = self.decay ** np.arange(n - 1, -1, -1)
+        batch_weight = weights.sum()
+        batch_mean = weights @ rows / batch_weight
+        deviations = rows - batch_mean
+        batch_comoments = (deviations * weights[:, None]).T @ deviations
+
+        # The state so far ages by n rows, then the two weighted sets are merged
+        aging = self.decay ** n
+        old_weight = self.weight * aging
+        weight = old_weight + batch_weight
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * batch_weight / weight
+        self.comoments = self.comoments * aging + batch_comoments + np.outer(delta, delta) * old_weight * batch_weight / weight
+        self.weight = weight
+        self.weight_squares = self.weight_squares * aging**2 + weights @ weights
+        self.count += n
+        return self
+
+    def covariance(self):
+        # Unbiased for the weights (the sample covariance when decay is 1); NaN with fewer than two rows
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.comoments / (self.weight - self.weight_squares / self.weight)
+
+    def to_dict(self):
+        return {'decay': self.decay, 'count': self.count, 'weight': self.weight, 'weight_squares': self.weight_squares,
+                'mean': self.mean.tolist(), 'comoments': self.comoments.tolist()}
+
+    @classmethod
+    def from_dict(cls, state):
+        moments = cls(len(state['mean']), state['decay'])
+        moments.count = state['count']
+        moments.weight = state['weight']
+        moments.weight_squares = state['weight_squares']
+        moments.mean = np.array(state['mean'], dtype=float)
+        moments.comoments = np.array(state['comoments'], dtype=float)
+        return moments
+
+
+class OnlineStatistics:
+    '''
+    Incremental counterpart of ReturnStatistics for histories that only grow by appended rows.
+    It keeps RunningMoments of the daily and monthly, simple and log returns, over the full history and exponentially
+    weighted with each half-life (years), plus the last levels and the last month-end levels, so new rows only need
+    the returns they add. Months count once they are complete (a row of the next month has been seen).
+    append takes new rows of the price files themselves: it also keeps the last row of each file (with the debt
+    index level reached) and the rows of one file whose date the other has not reached yet.
+    Means and volatilities in table() are annualized like in ReturnStatistics, with the half-life in place of the window.
+    '''
+
+    def __init__(self, halflives=HALFLIVES, debt_duration=0.0):
+        self.halflives = tuple(halflives)
+        self.debt_duration = debt_duration
+        self.last_date = None
+        self.last_levels = None
+        self.month_end_levels = None
+        self.last_equity = None  # (date, close)
+        self.last_debt = None    # (date, yield in %, debt index level)
+        self.pending = pd.DataFrame({'Equity': [], 'Debt': []}, index=pd.DatetimeIndex([]))
+        self.moments = {}
+        for frequency, periods in PERIODS_PER_YEAR.items():
+            for kind in ('simple', 'log'):
+                for halflife in (None,) + self.halflives:
+                    decay = 1.0 if halflife is None else 0.5 ** (1 / (halflife * periods))
+                    self.moments[(frequency, kind, halflife)] = RunningMoments(2, decay)
+
+    def update(self, levels):
+        '''
+        Adds the rows of levels (a frame with 'Equity' and 'Debt' levels, oldest first, as from asset_levels)
+        dated after the last row already seen. levels can be the whole history or only its latest rows:
+        the rows already seen are skipped with a binary search. Returns the number of rows added.
+        '''
+        if self.last_date is not None:
+            levels = levels.iloc[levels.index.searchsorted(self.last_date, side='right'):]
+        if levels.empty:
+            return 0
+
+        values = levels[['Equity', 'Debt']].to_numpy(dtype=float)
+        months = levels.index.to_period('M')
+        if self.last_date is not None:
+            values = np.vstack([self.last_levels, values])
+            months = months.insert(0, self.last_date.to_period('M'))
+
+        # A row is a month end when the next row is in another month
+        ends = values[:-1][months[1:] != months[:-1]]
+        if self.month_end_levels is not None:
+            ends = np.vstack([self.month_end_levels, ends])
+
+        new_returns = {'daily': values[1:] / values[:-1] - 1, 'monthly': ends[1:] / ends[:-1] - 1}
+        for (frequency, kind, _), moments in self.moments.items():
+            simple = new_returns[frequency]
+            moments.update(simple if kind == 'simple' else np.log1p(simple))
+
+        self.last_date = levels.index[-1]
+        self.last_levels = values[-1]
+        if len(ends):
+            self.month_end_levels = ends[-1]
+        return len(levels)
+
+    def append(self, equity_prices=None, debt_yields=None):
+        '''
+        Adds new rows of the price files: equity_prices the Close of Historical_Equity.xlsx and debt_yields the yield
+        (in %) of Historical_Debt.xlsx, each a Series by date, oldest first (None when a file has no new rows).
+        Rows at or before the last row already taken from a file are skipped, so whole files can be passed too.
+        The debt index continues from the saved last level (see debt_index) and the dates both files have
+        go to update, as asset_levels would give them, so the work only depends on the number of new rows.
+        Returns the number of rows added to the statistics.
+        '''
+        new_rows = {}
+        if equity_prices is not None:
+            if self.last_equity is not None:
+                equity_prices = equity_prices.iloc[equity_prices.index.searchsorted(self.last_equity[0], side='right'):]
+            if len(equity_prices):
+                new_rows['Equity'] = equity_prices.astype(float)
+                self.last_equity = (equity_prices.index[-1], float(equity_prices.iloc[-1]))
+        if debt_yields is not None:
+            previous = None
+            if self.last_debt is not None:
+                debt_yields = debt_yields.iloc[debt_yields.index.searchsorted(self.last_debt[0], side='right'):]
+                previous = (self.last_debt[0], self.last_debt[1] / 100, self.last_debt[2])
+            if len(debt_yields):
+                new_rows['Debt'] = debt_index(debt_yields / 100, self.debt_duration, previous)
+                self.last_debt = (debt_yields.index[-1], float(debt_yields.iloc[-1]), float(new_rows['Debt'].iloc[-1]))
+        if not new_rows:
+            return 0
+
+        pending = self.pending.combine_first(pd.DataFrame(new_rows, columns=['Equity', 'Debt']))
+        joint = pending.dropna()
+        added = self.update(joint)
+        # A date one file skipped can never be matched once the other file has moved past it
+        self.pending = pending.loc[pending.index > joint.index[-1]] if len(joint) else pending
+        return added
+
+    def table(self):
+        rows = {}
+        for (frequency, kind, halflife), moments in self.moments.items():
+            periods = PERIODS_PER_YEAR[frequency]
+            covariance = moments.covariance()
+            volatility = np.sqrt(np.maximum(np.diag(covariance), 0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                correlation = covariance[0, 1] / (volatility[0] * volatility[1])
+            rows[(frequency, kind, 'full' if halflife is None else halflife)] = {
+                'equity_mean': moments.mean[0] * periods,
+                'equity_vol': volatility[0] * np.sqrt(periods),
+                'debt_mean': moments.mean[1] * periods,
+                'debt_vol': volatility[1] * np.sqrt(periods),
+                'correlation': correlation,
+                'observations': moments.count,
+            }
+        table = pd.DataFrame.from_dict(rows, orient='index')
+        table.index.names = ['frequency', 'kind', 'halflife']
+        return table
+
+    def row(self, halflife=None, frequency='monthly', kind='simple'):
+        return self.table().loc[(frequency, kind, 'full' if halflife is None else halflife)]
+
+    def monthly_moments(self, halflife=None):
+        '''
+        Monthly (mu, sigma, cov_matrix) of simple returns as in ReturnStatistics.monthly_moments.
+        '''
+        return _monthly_moments(self.row(halflife))
+
+    def annual_returns(self, halflife=None):
+        '''
+        Compound annual growth rates (RE, RD) as in ReturnStatistics.annual_returns.
+        '''
+        return _annual_returns(self.row(halflife, kind='log'))
+
+    def matches(self, equity_prices, debt_yields):
+        # The price files continue this state: they still hold the last rows taken, with the same values
+        for prices, last in ((equity_prices, self.last_equity), (debt_yields, self.last_debt)):
+            if last is not None and (last[0] not in prices.index or not np.isclose(prices.loc[last[0]], last[1])):
+                return False
+        return True
+
+    def save(self, path):
+        state = {
+            'halflives': list(self.halflives),
+            'debt_duration': self.debt_duration,
+            'last_date': None if self.last_date is None else self.last_date.isoformat(),
+            'last_levels': None if self.last_levels is None else self.last_levels.tolist(),
+            'month_end_levels': None if self.month_end_levels is None else self.month_end_levels.tolist(),
+            'last_equity': None if self.last_equity is None else [self.last_equity[0].isoformat(), self.last_equity[1]],
+            'last_debt': None if self.last_debt is None else [self.last_debt[0].isoformat(), *self.last_debt[1:]],
+            'pending': [[date.isoformat(), *(None if np.isnan(value) else value for value in values)]
+                        for date, values in zip(self.pending.index, self.pending.to_numpy(dtype=float))],
+            'moments': [[frequency, kind, halflife, moments.to_dict()]
+                        for (frequency, kind, halflife), moments in self.moments.items()],
+        }
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            state = json.load(file)
+        statistics = cls(state['halflives'], state['debt_duration'])
+        if state['last_date'] is not None:
+            statistics.last_date = pd.Timestamp(state['last_date'])
+            statistics.last_levels = np.array(state['last_levels'], dtype=float)
+        if state['month_end_levels'] is not None:
+            statistics.month_end_levels = np.array(state['month_end_levels'], dtype=float)
+        if state['last_equity'] is not None:
+            statistics.last_equity = (pd.Timestamp(state['last_equity'][0]), state['last_equity'][1])
+        if state['last_debt'] is not None:
+            statistics.last_debt = (pd.Timestamp(state['last_debt'][0]), *state['last_debt'][1:])
+        if state['pending']:
+            statistics.pending = pd.DataFrame([row[1:] for row in state['pending']], columns=['Equity', 'Debt'],
+                                              index=pd.DatetimeIndex([row[0] for row in state['pending']]), dtype=float)
+        for frequency, kind, halflife, moments in state['moments']:
+            statistics.moments[(frequency, kind, halflife)] = RunningMoments.from_dict(moments)
+        return statistics
+
+
+# Function to bring the saved online statistics up to date with the history files
+def update_online_statistics(equity_path=EQUITY_PATH, debt_path=DEBT_PATH, state_path=None, debt_duration=0.0,
+                             halflives=HALFLIVES, equity_prices=None, debt_yields=None):
+    '''
+    Loads the OnlineStatistics saved next to the equity history (state_path, by default return_stats_state.json
+    in its folder), adds the new price rows with OnlineStatistics.append and saves it again.
+    The new rows are equity_prices / debt_yields when given (e.g. the rows the daily job has just appended, Series
+    by date as in append): the history files are then not read at all and the whole update is O(new rows).
+    Otherwise the files are read and append skips the rows up to the saved last dates with a binary search.
+    The state is built again from the whole files when it is missing, was saved with other settings,
+    or (when the files are read) no longer matches them because rows up to its last dates were changed or removed.
+    '''
+    if state_path is None:
+        state_path = os.path.join(os.path.dirname(equity_path), ONLINE_STATE_FILE)
+    try:
+        statistics = OnlineStatistics.load(state_path)
+    except (OSError, ValueError, KeyError):
+        statistics = None
+    if statistics is not None and (statistics.halflives != tuple(halflives) or statistics.debt_duration != debt_duration):
+        statistics = None
+
+    if statistics is None or (equity_prices is None and debt_yields is None):
+        history_equity = load_series(equity_path, 'Date', 'Close', '%d-%b-%y')
+        history_debt = load_series(debt_path, 'Date', 'Price')
+        if statistics is None or not statistics.matches(history_equity, history_debt):
+            statistics = OnlineStatistics(halflives, debt_duration)
+        statistics.append(history_equity, history_debt)
+    statistics.append(equity_prices, debt_yields)
+    statistics.save(state_path)
+    return statistics
+
+
+if __name__ == '__main__':
+    # Daily job: add the rows appended to the history files and print the refreshed statistics
+    statistics = update_online_statistics()
+    print(f"Statistics up to {statistics.last_date:%d-%b-%Y}")
+    print(statistics.table().to_string())
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+from dp_engine import grid_index, portfolio_moments
+
+# Default number of paths simulated at a time (bounds the memory used whatever the total number of paths)
+CHUNK_SIZE = 200_000
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+# Function to get the per-step moments of equity allocations in an (Equity, Debt) portfolio, as in dp.py
+def asset_moments(mu, sigma, cov_matrix):
+    return lambda allocations: portfolio_moments(allocations, mu, sigma, cov_matrix)
+
+
+# Function to get the per-step moments of allocations to one frontier portfolio, as in dynamic_caller.py
+def frontier_moments(mu, sigma, dt=1.0):
+    return lambda allocations: (allocations * mu * dt, allocations * sigma * np.sqrt(dt))
+
+
+# Largest lookup table used by grid_lookup before falling back to a binary search
+MAX_BUCKETS = 1 << 20
+
+
+# Function to build a fast version of dp_engine.grid_index for one grid
+def grid_lookup(wealth_grid):
+    '''
+    Returns a function mapping wealth values to the grid point at or below them, like grid_index.
+    The grid range is cut into equal buckets no wider than the smallest grid step, so each bucket holds at most
+    one grid point: a bucket lookup plus one comparison each way replaces the binary search.
+    '''
+    wealth_grid = np.asarray(wealth_grid, dtype=float)
+    last = len(wealth_grid) - 1
+    span = wealth_grid[-1] - wealth_grid[0]
+    n_buckets = int(np.ceil(span / np.diff(wealth_grid).min())) + 1 if last else 0
+    if not 0 < n_buckets <= MAX_BUCKETS:
+        return lambda wealth: grid_index(wealth_grid, wealth)
+
+    scale = (n_buckets - 1) / span
+    edges = wealth_grid[0] + np.arange(n_buckets) / scale
+    table = grid_index(wealth_grid, edges)
+    upper = np.append(wealth_grid[1:], np.inf)
+
+    def lookup(wealth):
+        j = table[np.clip(((wealth - wealth_grid[0]) * scale).astype(np.intp), 0, n_buckets - 1)]
+        j += wealth >= upper[j]
+        j -= (wealth < wealth_grid[j]) & (j > 0)
+        return j
+
+    return lookup
+
+
+# Function to read an optimal_policy_{index}.xlsx file written by dynamic_caller.py
+def load_policy(path):
+    '''
+    Returns (allocation_table, wealth_grid) with the table in the dp_engine layout:
+    one row per time step plus a terminal row, one column per wealth level.
+    '''
+    policy = pd.read_excel(path, index_col=0)
+    allocation_table = np.vstack([policy.to_numpy(dtype=float).T, np.zeros(len(policy))])
+    return allocation_table, policy.index.to_numpy(dtype=float)
+
+
+class SimulationResult:
+    '''
+    Summary of a forward simulation.
+    terminal_wealth: final wealth of every path.
+    success_probability: share of paths ending at or above the goal (None without a goal).
+    quantiles: {q: terminal wealth quantile}.
+    mean_wealth: mean wealth at every step, (n_steps + 1,).
+    mean_allocation: mean allocation used at every step, (n_steps,).
+    allocation_levels / allocation_shares: the allocation levels of the policy and, for every step,
+    the share of paths using each of them, (n_steps, levels).
+    wealth_paths / allocation_paths: the first n_recorded_paths paths in full.
+    '''
+
+    def __init__(self, terminal_wealth, goal, quantiles, mean_wealth, mean_allocation, allocation_levels,
+                 allocation_shares, wealth_paths, allocation_paths):
+        self.terminal_wealth = terminal_wealth
+        self.success_probability = None if goal is None else float(np.mean(terminal_wealth >= goal))
+        self.quantiles = dict(zip(quantiles, np.quantile(terminal_wealth, quantiles)))
+        self.mean_wealth = mean_wealth
+        self.mean_allocation = mean_allocation
+        self.allocation_levels = allocation_levels
+        self.allocation_shares = allocation_shares
+        self.wealth_paths = wealth_paths
+        self.allocation_paths = allocation_paths
+
+
+# Function to simulate a DP policy forward from the initial wealth
+def simulate_policy(allocation_table, wealth_grid, initial_wealth, moments, cash_flow=0.0, goal=None, n_paths=1_000_000,
+                    n_steps=None, rng=None, chunk_size=CHUNK_SIZE, quantiles=QUANTILES, n_recorded_paths=100):
+    '''
+    Simulates n_paths wealth paths under the policy in allocation_table (dp_engine layout, see load_policy).
+    At every step the allocation is read at the grid point at or below the current wealth (grid_index, the
+    mapping the DP was solved with), and wealth moves like in the DP:
+    W -> (W + cash_flow) * exp(mu - sigma^2 / 2 + sigma * Z), with (mu, sigma) = moments(allocation).
+    Paths are simulated chunk_size at a time as arrays, one NumPy operation per step for the whole chunk.
+    rng is a numpy Generator or a seed, so runs can be repeated exactly (with the same chunk_size).
+    It returns a SimulationResult.
+    '''
+    rng = np.random.default_rng(rng)
+    wealth_grid = np.asarray(wealth_grid, dtype=float)
+    allocation_table = np.asarray(allocation_table, dtype=float)
+    if n_steps is None:
+        n_steps = allocation_table.shape[0] - 1
+    decisions = allocation_table[:n_steps]
+
+    # Per-cell drift and volatility, and the allocation level index of every cell, looked up by (step, grid point)
+    portfolio_mu, portfolio_sigma = moments(decisions)
+    drift_table = portfolio_mu - 0.5 * portfolio_sigma**2
+    sigma_table = np.asarray(portfolio_sigma, dtype=float)
+    allocation_levels, level_table = np.unique(decisions, return_inverse=True)
+    level_table = level_table.reshape(decisions.shape)
+    lookup = grid_lookup(wealth_grid)
+
+    terminal_wealth = np.empty(n_paths)
+    wealth_sum = np.zeros(n_steps + 1)
+    level_counts = np.zeros((n_steps, len(allocation_levels)))
+    n_recorded_paths = min(n_recorded_paths, n_paths)
+    wealth_paths = np.empty((n_recorded_paths, n_steps + 1))
+    allocation_paths = np.empty((n_recorded_paths, n_steps))
+
+    for first in range(0, n_paths, chunk_size):
+        n = min(chunk_size, n_paths - first)
+        recorded = max(min(n_recorded_paths - first, n), 0)
+        wealth = np.full(n, float(initial_wealth))
+        wealth_sum[0] += wealth.sum()
+        wealth_paths[first:first + recorded, 0] = wealth[:recorded]
+        for t in range(n_steps):
+            j = lookup(wealth)
+            # Paths per grid point, then per allocation level
+            level_counts[t] += np.bincount(level_table[t], weights=np.bincount(j, minlength=len(wealth_grid)),
+                                           minlength=len(allocation_levels))
+            allocation_paths[first:first + recorded, t] = decisions[t, j[:recorded]]
+            wealth = (wealth + cash_flow) * np.exp(drift_table[t, j] + sigma_table[t, j] * rng.standard_normal(n))
+            wealth_sum[t + 1] += wealth.sum()
+            wealth_paths[first:first + recorded, t + 1] = wealth[:recorded]
+        terminal_wealth[first:first + n] = wealth
+
+    allocation_shares = level_counts / n_paths
+    return SimulationResult(terminal_wealth, goal, tuple(quantiles), wealth_sum / n_paths, allocation_shares @ allocation_levels,
+                            allocation_levels, allocation_shares, wealth_paths, allocation_paths)
@@ -0,0 +1,78 @@
+import math
+
+import numpy as np
+
+
+def future_value(i, EYR, DYR, Y, dt_per, eq_per):
+    '''
+    Future value of a monthly SIP of i split into debt and equity, before rounding.
+    The expression (and its evaluation order) is the one used by calculate_minimum_investment in app.py,
+    so the results match it bit for bit. Works on Python numbers and NumPy arrays alike.
+    '''
+    EMR = EYR / 12 / 100
+    DMR = DYR / 12 / 100
+    M = Y * 12
+    return ((i * (dt_per / 100)) * ((((1 + DMR) ** (M)) - 1) * (1 + DMR)) / DMR) + (
+            (i * (eq_per / 100)) * ((((1 + EMR) ** (M)) - 1) * (1 + EMR)) / EMR)
+
+
+def minimum_sip(A, EYR, DYR, Y, dt_per, eq_per, goal_amount, upper):
+    '''
+    Smallest whole-rupee SIP i in [1, upper] with round(future_value(i)) >= goal_amount, i.e. the answer of
+    scanning i = 1, 2, ... as the original loop did, without the scan.
+    The future value is linear in i, so goal_amount / future_value(1) lands next to the answer and a few
+    exact steps either side settle it (rounded future value never decreases as i grows).
+    It returns (i, rounded future value), or (A, None) when no i up to upper reaches the goal.
+    '''
+    upper = int(upper)
+    if upper < 1:
+        return A, None
+    per_rupee = future_value(1, EYR, DYR, Y, dt_per, eq_per)
+    if round(per_rupee) >= goal_amount:
+        return 1, round(per_rupee)
+    estimate = (goal_amount - 0.5) / per_rupee if per_rupee > 0 else math.inf
+    if not math.isfinite(estimate):
+        return A, None
+
+    i = min(max(math.ceil(estimate), 1), upper)
+    while i > 1 and round(future_value(i - 1, EYR, DYR, Y, dt_per, eq_per)) >= goal_amount:
+        i -= 1
+    while i <= upper and round(future_value(i, EYR, DYR, Y, dt_per, eq_per)) < goal_amount:
+        i += 1
+    if i > upper:
+        return A, None
+    return i, round(future_value(i, EYR, DYR, Y, dt_per, eq_per))
+
+
+def minimum_sip_vectorized(A, EYR, DYR, Y, dt_per, eq_per, goal_amount, upper=None):
+    '''
+    minimum_sip for whole columns (NumPy arrays or pandas Series) at once; upper defaults to int(A).
+    It returns two arrays: the SIP (A where the goal cannot be reached) and the rounded future value
+    (NaN where the goal cannot be reached).
+    '''
+    A, EYR, DYR, Y, dt_per, eq_per, goal_amount = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (A, EYR, DYR, Y, dt_per, eq_per, goal_amount)))
+    upper = np.floor(A) if upper is None else np.broadcast_to(np.asarray(upper, dtype=float), A.shape)
+
+    def reaches(i):
+        return np.round(future_value(i, EYR, DYR, Y, dt_per, eq_per)) >= goal_amount
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        per_rupee = future_value(1.0, EYR, DYR, Y, dt_per, eq_per)
+        estimate = np.where(per_rupee > 0, (goal_amount - 0.5) / per_rupee, np.inf)
+        i = np.clip(np.ceil(np.nan_to_num(estimate, nan=np.inf, posinf=np.inf)), 1, np.maximum(upper, 1))
+
+        # Walk down while the previous rupee still reaches the goal, then up until this one does
+        step = (i > 1) & reaches(i - 1)
+        while step.any():
+            i = i - step
+            step = (i > 1) & reaches(i - 1)
+        step = (i <= upper) & ~reaches(i)
+        while step.any():
+            i = i + step
+            step = (i <= upper) & ~reaches(i)
+
+        found = (upper >= 1) & (i <= upper) & reaches(i)
+        sip = np.where(found, i, A)
+        achieved = np.where(found, np.round(future_value(i, EYR, DYR, Y, dt_per, eq_per)), np.nan)
+    return sip, achieved
@@ -1,6 +1,8 @@
 import streamlit as st
-import pandas as pd
 from gbwm_solver import goal_programming_solver
+from data_loader import load_table
+from io import BytesIO
+from return_stats import default_annual_returns
 
 # Set page configuration
 st.set_page_config(page_title="Goal Based Wealth Management", page_icon="💸", layout="wide")
@@ -47,11 +49,23 @@ st.markdown("""
     Please provide the necessary inputs below to get started.
 """)
 
-# Function to parse uploaded Excel file
+# Function to parse uploaded Excel, CSV or Parquet file; reruns with the same file content reuse the parsed table
+@st.cache_data(max_entries=16)
+def parse_upload(content, name):
+    return load_table(BytesIO(content), name=name)
+
 def parse_excel(file):
-    df = pd.read_excel(file)
+    df = parse_upload(file.getvalue(), file.name)
     return df
 
+# Function to get the minimum investment of one goal, computed once per (RE, RD, Years, p_e, Goal)
+@st.cache_data(max_entries=4096)
+def solve_goal(RE, RD, Years, p_e, Goal):
+    return goal_programming_solver(RE, RD, Years, p_e, Goal)
+
+# Default yearly returns of the input form: compound annual returns of the last 10 years of history (see return_stats.py)
+DEFAULT_RE, DEFAULT_RD = default_annual_returns()
+
 # Initialize session state attributes
 if 'submitted' not in st.session_state:
     st.session_state.submitted = False
@@ -69,7 +83,7 @@ if 'upload_option' not in st.session_state:
 upload_option = st.radio("Choose an option:", ("Update Details Manually", "Upload Excel File"))
 
 if upload_option == "Upload Excel File":
-    uploaded_file = st.file_uploader("Upload Excel File", type=["xlsx", "xls"])
+    uploaded_file = st.file_uploader("Upload Excel File", type=["xlsx", "xls", "csv", "parquet"])
 
     if uploaded_file is not None:
         data = parse_excel(uploaded_file)
@@ -86,8 +100,8 @@ if upload_option == "Upload Excel File":
 
 if upload_option == "Update Details Manually":
     with st.form(key='investment_parameters'):
-        RE = st.number_input("Yearly Return in Equity (as a decimal, e.g., 0.07 for 7%)", value=0.11, step=0.01, format="%.2f")
-        RD = st.number_input("Yearly Return in Debt (as a decimal, e.g., 0.05 for 5%)", value=0.07, step=0.01, format="%.2f")
+        RE = st.number_input("Yearly Return in Equity (as a decimal, e.g., 0.07 for 7%)", value=round(DEFAULT_RE, 2), step=0.01, format="%.2f")
+        RD = st.number_input("Yearly Return in Debt (as a decimal, e.g., 0.05 for 5%)", value=round(DEFAULT_RD, 2), step=0.01, format="%.2f")
         p_e = st.number_input("Equity Allocation (as a decimal, e.g., 0.6 for 60%)", value=0.4, step=0.01, format="%.2f")
         Total_monthly_Investment_capacity = st.number_input("Total Monthly Investment Capacity", value=1000.0, step=100.0, format="%.2f")
         num_goals = st.number_input("Number of Financial Goals", min_value=1, step=1, value=st.session_state.num_goals)
@@ -128,7 +142,7 @@ if st.session_state.submitted:
                 st.error(f"Number of years for goal amount {Goal} cannot be zero.")
                 continue
             if remaining_investment_capacity > 0:
-                original_solution = goal_programming_solver(RE, RD, Years, p_e, Goal)
+                original_solution = solve_goal(RE, RD, Years, p_e, Goal)
                 remaining_investment_capacity -= original_solution
                 st.success(f"Minimum investment needed to achieve goal amount {Goal} in {Years} years with priority {Priority}: \u20B9{original_solution:.2f}")
                 st.info(f"Remaining investment amount: \u20B9{remaining_investment_capacity:.2f}")